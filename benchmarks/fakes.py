@@ -0,0 +1,436 @@
+"""
+benchmarks.fakes
+~~~~~~~~~~~~~~~~
+
+This module implements local stand-ins for the DiscoverOrg and Salesforce APIs.
+"""
+
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests as rq
+
+TITLES = [
+    "Vice President of Talent Acquisition",
+    "Director, Human Resources",
+    "Senior Recruiter",
+    "HR Business Partner",
+    "Talent Acquisition Manager",
+    "Recruiting Coordinator",
+    "HR Generalist",
+    "Chief People Officer",
+    "Head of Hiring",
+    "Software Engineer",
+    "Account Executive",
+    "Financial Analyst",
+    "Office Assistant",
+    "Marketing Specialist",
+    "Operations Lead",
+]
+
+COMPANY_ID_BASE = 1000
+
+FIRST_NAMES = ["Ada", "Ben", "Cleo", "Dev", "Eli", "Fay", "Gus", "Hana", "Ivo", "Jo"]
+LAST_NAMES = ["Reyes", "Stone", "Tran", "Ueda", "Vance", "Wolfe", "Xu", "Young"]
+
+
+def company_domain(index: int) -> str:
+    """Get the domain of a synthetic company.
+
+    :param index: The `int` index of the company.
+    :return: A `str` domain.
+    """
+    return f"company{index}.example.com"
+
+
+def make_people(domain: str, size: int) -> list:
+    """Generate a stable list of synthetic DiscoverOrg person records.
+
+    :param domain: The `str` domain of the company.
+    :param size: The `int` number of people.
+    :return: A `list` of person record `dict` objects.
+    """
+    rng: random.Random = random.Random(domain)
+    people: list = []
+    for i in range(size):
+        first: str = rng.choice(FIRST_NAMES)
+        last: str = f"{rng.choice(LAST_NAMES)}{i}"
+        people.append(
+            {
+                "fullName": f"{first} {last}",
+                "title": rng.choice(TITLES),
+                "officeTelNumber": f"555-{i:04d}",
+                "mobileTelNumber": "",
+                "email": f"{first}.{last}@{domain}".lower()
+                if rng.random() > 0.1
+                else "",
+            }
+        )
+
+    return people
+
+
+class FakeDiscoverOrg:
+    """Implement the `FakeDiscoverOrg` class.
+
+    This class serves a local HTTP imitation of the DiscoverOrg API with
+    paginated person searches, a configurable latency per request, and a request
+    quota per window that answers with a 429 and `X-Rate-Limit-Reset` once it is
+    exceeded.
+    """
+
+    def __init__(
+        self,
+        people: int = 250,
+        page_size: int = 100,
+        latency: float = 0.02,
+        quota: int = 0,
+        window: float = 1.0,
+        person_filter: bool = True,
+        skew: int = 1,
+    ):
+        self.people: int = people
+        self.skew: int = skew
+        self.page_size: int = page_size
+        self.latency: float = latency
+        self.quota: int = quota
+        self.window: float = window
+        self.person_filter: bool = person_filter
+
+        self.calls: Counter = Counter()
+        self.bytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._window_start: float = time.time()
+        self._window_count: int = 0
+
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._handler()
+        )
+        self.server.daemon_threads = True
+        self._thread: threading.Thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/papi"
+
+    def start(self) -> "FakeDiscoverOrg":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _admit(self) -> tuple:
+        """Count a request against the quota.
+
+        :return: A `tuple` of whether it is admitted and the rate limit headers.
+        """
+        with self._lock:
+            now: float = time.time()
+            if now - self._window_start >= self.window:
+                self._window_start, self._window_count = now, 0
+
+            reset: float = self._window_start + self.window
+            if self.quota and self._window_count >= self.quota:
+                admitted: bool = False
+            else:
+                admitted: bool = True
+                self._window_count += 1
+
+            remaining: int = max(self.quota - self._window_count, 0)
+
+        headers: dict = {"X-Rate-Limit-Reset": f"{reset:.3f}"}
+        if self.quota:
+            headers["X-Rate-Limit-Limit"] = str(self.quota)
+            headers["X-Rate-Limit-Remaining"] = str(remaining)
+
+        return admitted, headers
+
+    def _size(self, domain: str) -> int:
+        """Get the number of people at a company, `skew` times more at every fourth."""
+        if zlib.crc32(domain.encode()) % 4 == 0:
+            return self.people * self.skew
+
+        return self.people
+
+    def _respond(self, path: str, query: dict, body: dict) -> tuple:
+        """Build the status, headers, and body of a response.
+
+        :return: A `tuple` of the `int` status, `dict` headers, and `dict` body.
+        """
+        if path.endswith("/login"):
+            return 200, {"X-AUTH-TOKEN": "fake-token"}, {}
+
+        criteria: dict = body.get("companyCriteria", {})
+        urls: list = criteria.get("websiteUrls") or [""]
+        domain: str = re.sub(r"^(https?://)?(www\.)?", "", urls[0] or "")
+        domain: str = domain.split("/")[0]
+
+        if path.endswith("/v1/search/companies"):
+            ids: list = criteria.get("companyIds") or [
+                zlib.crc32(domain.encode()) % 10 ** 6
+            ]
+            content: list = []
+            for i in ids:
+                # Companies looked up by ID are those of the accounts
+                # `FakeSalesforce` makes, so they have the same sizes.
+                site: str = domain or company_domain(int(i) - COMPANY_ID_BASE)
+                content.append(
+                    {
+                        "id": i,
+                        "name": criteria.get("queryString", site),
+                        "description": f"A synthetic company at {site}.",
+                        "numEmployees": self._size(site) * 10,
+                        "revenue": self._size(site) * 100000,
+                        "location": {
+                            "city": "Springfield",
+                            "stateProvinceRegion": "IL",
+                            "countryName": "United States",
+                        },
+                    }
+                )
+            return 200, {}, {"content": content}
+
+        if path.endswith("/v1/search/persons"):
+            page: int = int(query.get("pageNumber", ["0"])[0])
+            people: list = make_people(domain, self._size(domain))
+            if "personCriteria" in body or "fields" in body:
+                if not self.person_filter:
+                    return 400, {}, {"message": "Unsupported criteria."}
+                people = _filter_people(people, body)
+            total: int = max((len(people) + self.page_size - 1) // self.page_size, 1)
+            start: int = page * self.page_size
+            return (
+                200,
+                {},
+                {
+                    "content": people[start : start + self.page_size],
+                    "number": page,
+                    "totalPages": total,
+                    "totalElements": len(people),
+                    "last": page >= total - 1,
+                },
+            )
+
+        return 404, {}, {}
+
+    def _handler(self) -> type:
+        fake: FakeDiscoverOrg = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                length: int = int(self.headers.get("Content-Length") or 0)
+                raw: bytes = self.rfile.read(length) if length else b""
+
+                time.sleep(fake.latency)
+
+                admitted, headers = fake._admit()
+                if admitted:
+                    status, extra, body = fake._respond(
+                        parsed.path, parse_qs(parsed.query), json.loads(raw or b"{}")
+                    )
+                    headers.update(extra)
+                else:
+                    status, body = 429, {}
+
+                data: bytes = json.dumps(body).encode()
+                with fake._lock:
+                    fake.calls[(parsed.path.rsplit("/", 1)[-1], status)] += 1
+                    fake.bytes += len(data)
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _filter_people(people: list, body: dict) -> list:
+    """Apply the person criteria and field list of a search to its results."""
+    criteria: dict = body.get("personCriteria", {})
+
+    terms: list = re.findall(r'"([^"]+)"', criteria.get("queryString", ""))
+    if terms:
+        people = [p for p in people if any(t in p["title"].upper() for t in terms)]
+    if criteria.get("emailAvailable"):
+        people = [p for p in people if p["email"]]
+    if body.get("fields"):
+        people = [{k: p[k] for k in body["fields"] if k in p} for p in people]
+
+    return people
+
+
+class FakeSalesforce:
+    """Implement the `FakeSalesforce` class.
+
+    This class imitates the parts of a `simple_salesforce.Salesforce` instance
+    that OSCR uses, over a set of synthetic accounts, with a configurable latency
+    per API call.
+    """
+
+    def __init__(self, accounts: int = 20, contacts: int = 5, latency: float = 0.05):
+        self.latency: float = latency
+        self.calls: Counter = Counter()
+        self.inserted: list = []
+        self.updated: set = set()
+        self._lock: threading.Lock = threading.Lock()
+
+        self.accounts: list = [
+            {
+                "Id": f"001{i:015d}",
+                "DSCORGPKG__DiscoverOrg_ID__c": (
+                    float(COMPANY_ID_BASE + i) if i % 2 else None
+                ),
+                "Name": f"Company {i}",
+                "Phone": f"555-{i:04d}",
+                "Website": f"https://www.{company_domain(i)}",
+                "Enrichment_Requested_By__c": "005000000000000001",
+                "Enrichment_Requested_Date__c": "2020-01-01T00:00:00.000+0000",
+                "SystemModstamp": "2020-01-01T00:00:00.000+0000",
+            }
+            for i in range(accounts)
+        ]
+        self.contacts: list = []
+        for account in self.accounts:
+            domain: str = account["Website"].split("www.")[-1]
+            for person in make_people(domain, contacts):
+                self.contacts.append(
+                    {
+                        "Id": f"003{len(self.contacts):015d}",
+                        "AccountId": account["Id"],
+                        "Name": person["fullName"],
+                        "Title": person["title"],
+                        "Phone": person["officeTelNumber"],
+                        "MobilePhone": "",
+                        "Email": person["email"],
+                        "Contact_Status__c": "",
+                    }
+                )
+
+        self.base_url: str = "https://fake.salesforce.local/services/data/v52.0/"
+        self.headers: dict = {"Authorization": "Bearer fake"}
+        self.session: _FakeIngest = _FakeIngest(self)
+
+    def _call(self, name: str) -> None:
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[name] += 1
+
+    def query_all(self, sql: str) -> dict:
+        self._call("query")
+        return {"records": self._select(sql)}
+
+    def query_all_iter(self, sql: str):
+        self._call("query")
+        records: list = self._select(sql)
+        for start in range(0, len(records), 2000):
+            if start:
+                self._call("queryMore")
+            yield from records[start : start + 2000]
+
+    def _select(self, sql: str) -> list:
+        if re.search(r"FROM\s+Account", sql):
+            limit = re.search(r"LIMIT\s+(\d+)", sql)
+            accounts: list = [a for a in self.accounts if a["Id"] not in self.updated]
+            since = re.search(r"SystemModstamp\s*>=\s*(\S+)", sql)
+            if since:
+                watermark: str = re.sub(r"([+-]\d\d):(\d\d)$", r"\1\2", since.group(1))
+                accounts = [a for a in accounts if a["SystemModstamp"] >= watermark]
+            return accounts[: int(limit.group(1))] if limit else accounts
+
+        ids: set = set(re.findall(r"'(\w+)'", sql))
+        return [c for c in self.contacts if c["AccountId"] in ids]
+
+
+class _FakeResponse:
+    """Imitate the parts of a `requests.Response` the bulk engine reads."""
+
+    def __init__(self, body=None, text: str = "", status_code: int = 200):
+        self.status_code: int = status_code
+        self.text: str = text if body is None else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise rq.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class _FakeIngest:
+    """Imitate the Bulk API 2.0 ingest endpoints over a `FakeSalesforce`.
+
+    Jobs complete as soon as their upload is marked complete, and every row
+    succeeds.
+    """
+
+    def __init__(self, sf: FakeSalesforce):
+        self.sf: FakeSalesforce = sf
+        self.jobs: dict = {}
+
+    def request(self, method: str, url: str, headers=None, json=None, data=None):
+        path: list = url.split("jobs/ingest/", 1)[1].strip("/").split("/")
+        job_id: str = path[0]
+
+        if method == "POST":
+            self.sf._call(f"bulk.{json['object']}.{json['operation']}")
+            with self.sf._lock:
+                job_id = f"750{len(self.jobs):015d}"
+                self.jobs[job_id] = dict(json, rows=[], state="Open")
+            return _FakeResponse({"id": job_id})
+
+        job: dict = self.jobs.get(job_id)
+        if job is None:
+            return _FakeResponse({"message": "not found"}, status_code=404)
+
+        if method == "PUT":
+            job["rows"] = list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+            return _FakeResponse(text="")
+
+        if method == "PATCH" and json.get("state") == "Aborted":
+            job["state"] = "Aborted"
+            return _FakeResponse({"state": job["state"]})
+
+        if method == "PATCH":
+            with self.sf._lock:
+                if job["operation"] == "insert":
+                    self.sf.inserted.extend(job["rows"])
+                else:
+                    self.sf.updated.update(row["Id"] for row in job["rows"])
+            job["state"] = "JobComplete"
+            return _FakeResponse({"state": job["state"]})
+
+        if len(path) == 1:
+            return _FakeResponse({"id": job_id, "state": job["state"]})
+
+        rows: list = job["rows"] if path[1] == "successfulResults" else []
+        buffer: io.StringIO = io.StringIO()
+        fields: list = ["sf__Id", "sf__Created"] + list(rows[0] if rows else {})
+        writer: csv.DictWriter = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for i, row in enumerate(rows):
+            record_id: str = row.get("Id") or f"003{job_id[3:]}{i}"
+            writer.writerow(dict(row, sf__Id=record_id, sf__Created="true"))
+
+        return _FakeResponse(text=buffer.getvalue())
@@ -0,0 +1,263 @@
+"""
+benchmarks.run
+~~~~~~~~~~~~~~
+
+This module drives `oscr.__main__.run` end to end against local API stand-ins.
+
+Usage:
+
+    python -m benchmarks.run --accounts 50 --people 400 --workers 8
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.1
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from functools import wraps
+from statistics import quantiles
+
+import oscr.__main__ as main
+from oscr.clients.discoverorg import DiscoverOrgClient
+from oscr.clients.salesforce import SalesforceClient
+from oscr.metrics import METRICS
+
+from benchmarks.fakes import FakeDiscoverOrg, FakeSalesforce
+
+
+class Stages:
+    """Implement the `Stages` class.
+
+    This class records the latency of every call to the methods it wraps, and
+    the time each call ended.
+    """
+
+    def __init__(self):
+        self.samples: dict = defaultdict(list)
+        self.ends: dict = defaultdict(list)
+        self._lock: threading.Lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+            self.ends[stage].append(time.perf_counter())
+
+    def wrap(self, obj, name: str, stage: str = None, generator: bool = False):
+        """Replace a method of an object with a timed equivalent.
+
+        A generator method is timed until it is exhausted.
+        """
+        method = getattr(obj, name)
+        stage: str = stage or name
+
+        if generator:
+
+            @wraps(method)
+            def timed(*args, **kwargs):
+                start: float = time.perf_counter()
+                try:
+                    yield from method(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        else:
+
+            @wraps(method)
+            def timed(*args, **kwargs):
+                start: float = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        setattr(obj, name, timed)
+
+    def summary(self) -> dict:
+        """Summarize each stage's call count and latency percentiles."""
+        summary: dict = {}
+        for stage, samples in sorted(self.samples.items()):
+            if len(samples) > 1:
+                cuts: list = quantiles(samples, n=100, method="inclusive")
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = samples[0]
+
+            summary[stage] = {
+                "calls": len(samples),
+                "p50": round(p50, 4),
+                "p95": round(p95, 4),
+                "p99": round(p99, 4),
+                "total": round(sum(samples), 4),
+            }
+
+        return summary
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    """Run one benchmark and report its results.
+
+    :param args: The parsed command line arguments.
+    :return: A `dict` report.
+    """
+    server: FakeDiscoverOrg = FakeDiscoverOrg(
+        people=args.people,
+        page_size=args.page_size,
+        latency=args.do_latency,
+        quota=args.quota,
+        window=args.window,
+        person_filter=not args.reject_filter,
+        skew=args.skew,
+    ).start()
+    sf: FakeSalesforce = FakeSalesforce(
+        accounts=args.accounts, contacts=args.existing, latency=args.sf_latency
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            {
+                "DO_BASE_URL": server.url,
+                "DO_CACHE_PATH": os.path.join(tmp, "cache.sqlite3"),
+                "DO_RATE_LIMIT_FILE": os.path.join(tmp, "ratelimit"),
+                "OSCR_SPILL_DIR": tmp,
+                "OSCR_JOURNAL": os.path.join(tmp, "journal.jsonl"),
+                "OSCR_TOKEN_STORE": os.path.join(tmp, "tokens"),
+            }
+        )
+        if args.server_filter:
+            os.environ["DO_SERVER_FILTER"] = "1"
+        else:
+            os.environ.pop("DO_SERVER_FILTER", None)
+
+        stages: Stages = Stages()
+        sfc: SalesforceClient = SalesforceClient(api=sf)
+        doc: DiscoverOrgClient = DiscoverOrgClient()
+
+        stages.wrap(sfc, "prefetch_contacts", "sf.prefetch_contacts")
+        stages.wrap(sfc, "get_contacts", "sf.get_contacts", generator=True)
+        stages.wrap(sfc, "upload_contacts", "sf.upload_contacts")
+        stages.wrap(sfc, "upload_contacts_csv", "sf.upload_contacts")
+        stages.wrap(sfc, "complete_enrichment", "sf.complete_enrichment")
+        stages.wrap(doc, "get_company_info", "do.get_company_info")
+        stages.wrap(doc, "get_contacts", "do.get_contacts", generator=True)
+        stages.wrap(main, "enrich", "enrich")
+
+        enrich = main.enrich.__wrapped__
+        METRICS.reset()
+        tracemalloc.start()
+        start: float = time.perf_counter()
+        try:
+            main.run(workers=args.workers, sfc=sfc, doc=doc)
+        finally:
+            elapsed: float = time.perf_counter() - start
+            peak: int = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            main.enrich = enrich
+            server.stop()
+
+    waits: list = sorted(end - start for end in stages.ends["enrich"])
+
+    return {
+        "accounts": args.accounts,
+        "seconds": round(elapsed, 4),
+        "accounts_per_sec": round(args.accounts / elapsed, 4),
+        "time_to_enriched": {
+            "p50": round(waits[len(waits) // 2], 4) if waits else None,
+            "max": round(waits[-1], 4) if waits else None,
+        },
+        "stages": stages.summary(),
+        "api_calls": {
+            "discoverorg": {
+                f"{endpoint} {status}": n
+                for (endpoint, status), n in sorted(server.calls.items())
+            },
+            "salesforce": dict(sorted(sf.calls.items())),
+        },
+        "discoverorg_bytes": server.bytes,
+        "counters": METRICS.summary()["counters"],
+        "contacts_uploaded": len(sf.inserted),
+        "accounts_completed": len(sf.updated),
+        "peak_traced_bytes": peak,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list:
+    """Compare a report against a baseline.
+
+    :param report: A `dict` report.
+    :param baseline: A `dict` baseline report.
+    :param threshold: The `float` fraction by which a metric may worsen.
+    :return: A `list` of `str` regression descriptions.
+    """
+    found: list = []
+
+    if report["accounts_per_sec"] < baseline["accounts_per_sec"] * (1 - threshold):
+        found.append(
+            f"accounts/sec fell from {baseline['accounts_per_sec']} "
+            f"to {report['accounts_per_sec']}"
+        )
+
+    for stage, stats in report["stages"].items():
+        before: dict = baseline.get("stages", {}).get(stage)
+        if before and stats["p95"] > before["p95"] * (1 + threshold):
+            found.append(f"{stage} p95 rose from {before['p95']} to {stats['p95']}")
+
+    if report["peak_traced_bytes"] > baseline["peak_traced_bytes"] * (1 + threshold):
+        found.append(
+            f"peak memory rose from {baseline['peak_traced_bytes']} "
+            f"to {report['peak_traced_bytes']} bytes"
+        )
+
+    return found
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark OSCR offline.")
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--people", type=int, default=250, help="people per company")
+    parser.add_argument("--existing", type=int, default=5, help="contacts per account")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--do-latency", type=float, default=0.02)
+    parser.add_argument("--sf-latency", type=float, default=0.05)
+    parser.add_argument("--quota", type=int, default=0, help="requests per window")
+    parser.add_argument("--window", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--skew", type=int, default=1, help="size multiple of every fourth company"
+    )
+    parser.add_argument("--server-filter", action="store_true")
+    parser.add_argument(
+        "--reject-filter", action="store_true", help="answer filtered searches 400"
+    )
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against this report")
+    parser.add_argument("--threshold", type=float, default=0.1)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args: argparse.Namespace = parse_args()
+    report: dict = benchmark(args)
+
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found: list = regressions(report, json.load(f), args.threshold)
+
+        for regression in found:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+
+        sys.exit(1 if found else 0)
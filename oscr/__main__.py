@@ -5,60 +5,460 @@ oscr.main
 This module implements the the system's main script.
 """
 
-from logging import getLogger, info, INFO
-from typing import Generator
+import argparse
+import os
+import signal
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from logging import getLogger, error, info, warning, INFO
 
+from oscr.journal import Journal, default_path
+from oscr.metrics import METRICS
+from oscr.models import Account
+from oscr.pipeline import UploadPipeline
+from oscr.profiling import PROFILER
+from oscr.scheduler import Scheduler
+from oscr.sharding import Claims, Shard
 from oscr.utils import enrich
 from oscr.clients.discoverorg import DiscoverOrgClient
 from oscr.clients.salesforce import SalesforceClient
 
 
-def run():
+def run(
+    workers: int = None,
+    sfc: SalesforceClient = None,
+    doc: DiscoverOrgClient = None,
+    shard: Shard = None,
+    claims: Claims = None,
+):
     """Collects and enriches accounts.
 
     This method contains a mechanism to remove any duplicate contacts
     from DiscoverOrg that may already exist in Salesforce. It also calls on the
     method that sorts/cleans the contact list before it is written to Salesforce.
+
+    Finished accounts are handed to an `UploadPipeline`, which writes them to
+    Salesforce in batches while the remaining accounts are still being enriched.
+
+    Accounts are enriched concurrently by a bounded pool of worker threads. The
+    size of that pool is taken from `workers`, or from the environment variable
+    `OSCR_WORKERS` if it isn't given. Accounts are started in the order given by
+    a `Scheduler`, and their results are journaled and uploaded as soon as each
+    finishes. An account whose enrichment fails is logged and skipped without
+    affecting the others.
+
+    Every finished account is recorded in a `Journal` before it is uploaded. If an
+    earlier run died partway through, the accounts it journaled are not enriched
+    again, and only their unfinished writes are replayed. A journaled account
+    that isn't collected, such as one past `SF_ACCOUNT_LIMIT`, stays journaled
+    for a later run.
+
+    Each stage of the run is measured, and the metrics are exported when it
+    finishes (see `oscr.metrics`).
+
+    If a `shard` is given, only the accounts that belong to it are enriched, and
+    its journal is kept apart from other shards'. If `claims` are given, only
+    the accounts this process manages to claim are enriched, it keeps a journal
+    of its own, and its claims are released when the run finishes.
+
+    :param workers: An optional `int` number of concurrent enrichment workers.
+    :param sfc: An optional `SalesforceClient` to use instead of a new one.
+    :param doc: An optional `DiscoverOrgClient` to use instead of a new one.
+    :param shard: An optional `Shard` of the accounts to enrich.
+    :param claims: Optional `Claims` through which accounts are claimed.
     """
+    workers: int = workers or int(os.getenv("OSCR_WORKERS", 4))
+
     info("Initiating clients.")
-    sfc: SalesforceClient = SalesforceClient()
-    doc: DiscoverOrgClient = DiscoverOrgClient()
+    sfc: SalesforceClient = sfc or SalesforceClient()
+    doc: DiscoverOrgClient = doc or DiscoverOrgClient()
 
     info("Collecting accounts.")
-    accounts: Generator = sfc.get_accounts()
-    info("Accounts retrieved.")
+    limit: int = int(os.getenv("SF_ACCOUNT_LIMIT", 0))
+    with METRICS.timer("sf.get_accounts"):
+        accounts: list = list(sfc.get_accounts(limit=limit))
+    info(f"{len(accounts)} accounts retrieved.")
+    scanned: list = accounts if _complete(accounts, limit) else None
+
+    if shard or claims:
+        accounts: list = _assign(accounts, shard, claims)
+        info(f"{len(accounts)} accounts assigned to this process.")
+
+    journal: Journal = _journal(shard, claims)
+    replay: list = journal.replay(accounts, scanned)
+    if replay:
+        info(f"Replaying {len(replay)} accounts from the journal.")
+        replayed: set = {account.salesforce_id for account, _ in replay}
+        accounts: list = [a for a in accounts if a.salesforce_id not in replayed]
+
+    info("Collecting existing contacts and company records.")
+    _prefetch(sfc, doc, accounts)
+
+    accounts: list = Scheduler().order(accounts, doc.estimate_cost)
 
+    pipeline: UploadPipeline = UploadPipeline(sfc, journal)
+    for account, contacts in replay:
+        pipeline.add(account, contacts)
+
+    info(f"Launching enrichment process with {workers} workers.")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: dict = {
+            executor.submit(_enrich, sfc, doc, account): account
+            for account in accounts
+        }
+
+        for future in as_completed(futures):
+            _finish(futures[future], future, journal, pipeline)
+
+    pipeline.close()
+    journal.close()
+    if claims:
+        claims.release_all()
+
+    METRICS.export()
+
+
+def watch(
+    interval: float = None,
+    rescan: float = None,
+    workers: int = None,
+    sfc: SalesforceClient = None,
+    doc: DiscoverOrgClient = None,
+    stop: threading.Event = None,
+    shard: Shard = None,
+    claims: Claims = None,
+):
+    """Enrich accounts continuously as enrichment is requested on them.
+
+    The clients, their sessions, the worker pool, and the upload pipeline stay
+    up between polls. Each poll only asks Salesforce for the accounts modified
+    since the newest `SystemModstamp` seen so far, and accounts are enriched and
+    uploaded as soon as they arrive, without a cap on how many. Every `rescan`
+    seconds, a full scan picks up any account the watermark missed, and retries
+    accounts whose enrichment failed. Accounts still being written are never
+    enriched twice, and the unfinished writes of an account are kept in the
+    journal until a poll returns it again, when they are replayed.
+
+    The poll and rescan intervals, in seconds, are taken from the environment
+    variables `OSCR_POLL_INTERVAL` and `OSCR_RESCAN_INTERVAL` if they aren't
+    given. Metrics are exported after every poll, with the latency percentiles
+    of that poll and running totals. A poll that fails is logged, and polling
+    backs off exponentially until one succeeds. The loop ends gracefully on
+    SIGINT or SIGTERM, or when `stop` is set.
+
+    A `shard` and `claims` restrict the accounts enriched as they do in `run`.
+    Each claim is released once its account has been written or has failed.
+
+    :param interval: An optional `float` number of seconds between polls.
+    :param rescan: An optional `float` number of seconds between full scans.
+    :param workers: An optional `int` number of concurrent enrichment workers.
+    :param sfc: An optional `SalesforceClient` to use instead of a new one.
+    :param doc: An optional `DiscoverOrgClient` to use instead of a new one.
+    :param stop: An optional `threading.Event` that ends the loop when set.
+    :param shard: An optional `Shard` of the accounts to enrich.
+    :param claims: Optional `Claims` through which accounts are claimed.
+    """
+    interval: float = interval or float(os.getenv("OSCR_POLL_INTERVAL", 30))
+    rescan: float = rescan or float(os.getenv("OSCR_RESCAN_INTERVAL", 3600))
+    workers: int = workers or int(os.getenv("OSCR_WORKERS", 4))
+    limit: int = int(os.getenv("SF_ACCOUNT_LIMIT", 0))
+    stop: threading.Event = stop or threading.Event()
+
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+    info("Initiating clients.")
+    sfc: SalesforceClient = sfc or SalesforceClient()
+    doc: DiscoverOrgClient = doc or DiscoverOrgClient()
+
+    journal: Journal = _journal(shard, claims)
+    pipeline: UploadPipeline = UploadPipeline(sfc, journal)
+    scheduler: Scheduler = Scheduler()
+
+    watermark: str = None
+    scanned: float = None
+    failures: int = 0
+    handled: dict = {}
+    running: dict = {}
+
+    info(f"Watching for accounts with {workers} workers.")
     try:
-        info("Launching enrichment process.")
-        completed_contacts = []
-        completed_accounts = []
-        while accounts:
-            account = next(accounts)
-            contacts, company_info, summary = enrich(sfc, doc, account)
-            info(f"Data prepared for {account.name}.")
-
-            completed_contacts.extend(contacts)
-
-            account.notes: str = "<br><br>".join([company_info, summary])
-            completed_accounts.append(account)
-
-    except StopIteration:
-        if completed_contacts:
-            info(f"Uploading {len(completed_contacts)} contacts.")
-            sfc.upload_contacts(completed_contacts)
-            info("Upload complete.")
-
-        if completed_accounts:
-            info(f"Completing enrichment on {len(completed_accounts)} accounts.")
-            sfc.complete_enrichment(completed_accounts)
-            info("Enrichment complete.")
-
-        pass
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while not stop.is_set():
+                full: bool = scanned is None or time.monotonic() - scanned >= rescan
+                try:
+                    if full:
+                        handled.clear()
+
+                    with METRICS.timer("sf.get_accounts"):
+                        accounts: list = list(
+                            sfc.get_accounts(None if full else watermark, limit)
+                        )
+                    scanned: list = (
+                        accounts if full and _complete(accounts, limit) else None
+                    )
+
+                    newest: str = max(
+                        [watermark or ""] + [a.modified for a in accounts]
+                    )
+                    if shard:
+                        accounts = [
+                            a for a in accounts if shard.owns(a.salesforce_id)
+                        ]
+                    if claims:
+                        accounts = [
+                            a
+                            for a in accounts
+                            if a.salesforce_id in claims.held
+                            or (
+                                handled.get(a.salesforce_id) != a.modified
+                                and claims.claim(a.salesforce_id)
+                            )
+                        ]
+
+                    for account, contacts in journal.replay(accounts, scanned):
+                        handled[account.salesforce_id] = account.modified
+                        pipeline.add(account, contacts)
+
+                    accounts = [
+                        a
+                        for a in accounts
+                        if a.salesforce_id not in running
+                        and not journal.is_open(a.salesforce_id)
+                        and handled.get(a.salesforce_id) != a.modified
+                    ]
+                    if accounts:
+                        info(f"{len(accounts)} accounts to enrich.")
+                        _prefetch(sfc, doc, accounts)
+                        accounts = scheduler.order(accounts, doc.estimate_cost)
+
+                    for account in accounts:
+                        handled[account.salesforce_id] = account.modified
+                        running[account.salesforce_id] = (
+                            account,
+                            executor.submit(_enrich, sfc, doc, account),
+                        )
+
+                    watermark = newest or None
+                    if full:
+                        scanned = time.monotonic()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    error(f"Poll failure ({failures} in a row). {e}")
+
+                # After consecutive failures, polls are spaced out exponentially,
+                # up to 32 intervals apart, while running accounts still finish.
+                delay: float = interval * 2 ** min(failures, 5)
+                deadline: float = time.monotonic() + delay
+                while not stop.is_set() and time.monotonic() < deadline:
+                    timeout: float = min(deadline - time.monotonic(), 1.0)
+                    if not running:
+                        stop.wait(max(timeout, 0))
+                        continue
+
+                    done, _ = wait(
+                        [future for _, future in running.values()],
+                        timeout=max(timeout, 0),
+                        return_when=FIRST_COMPLETED,
+                    )
+                    for account, future in list(running.values()):
+                        if future in done:
+                            del running[account.salesforce_id]
+                            _finish(account, future, journal, pipeline)
+
+                    if not running:
+                        pipeline.flush()
+
+                if claims:
+                    for account_id in list(claims.held):
+                        if not (account_id in running or journal.is_open(account_id)):
+                            claims.release(account_id)
+
+                journal.compact()
+                METRICS.export()
+                METRICS.roll()
+
+            info("Stopping. Finishing the accounts in progress.")
+            for account, future in running.values():
+                _finish(account, future, journal, pipeline)
     finally:
-        del accounts
+        pipeline.close()
+        journal.close()
+        if claims:
+            claims.release_all()
+
+        METRICS.export()
+
+
+def _assign(accounts: list, shard: Shard, claims: Claims) -> list:
+    """Keep the accounts that belong to this process.
+
+    :param accounts: A `list` of `Account` objects.
+    :param shard: An optional `Shard` the accounts must belong to.
+    :param claims: Optional `Claims` through which the accounts must be claimed.
+    :return: A `list` of the `Account` objects to enrich.
+    """
+    if shard:
+        accounts = [a for a in accounts if shard.owns(a.salesforce_id)]
+    if claims:
+        accounts = [a for a in accounts if claims.claim(a.salesforce_id)]
+
+    return accounts
+
+
+def _complete(accounts: list, limit: int) -> bool:
+    """Check whether a scan returned every pending account, or stopped at a limit.
+
+    :param accounts: The `list` of `Account` objects the scan returned.
+    :param limit: The `int` maximum number of accounts, or 0 for none.
+    :return: `True` if no pending account was left out.
+    """
+    return not limit or len(accounts) < limit
+
+
+def _prefetch(sfc: SalesforceClient, doc: DiscoverOrgClient, accounts: list) -> None:
+    """Load the existing contacts and company records of accounts in bulk.
+
+    Both are looked up per account when they aren't prefetched, so a failed
+    prefetch is logged, and the accounts are enriched regardless.
+
+    :param sfc: A `SalesforceClient`.
+    :param doc: A `DiscoverOrgClient`.
+    :param accounts: A `list` of `Account` objects.
+    """
+    try:
+        sfc.prefetch_contacts(accounts)
+    except Exception as e:
+        warning(f"Couldn't prefetch existing contacts. {e}")
+
+    try:
+        doc.prefetch_companies(accounts)
+    except Exception as e:
+        warning(f"Couldn't prefetch company records. {e}")
+
+
+def _journal(shard: Shard, claims: Claims) -> Journal:
+    """Open the journal of a shard, or of this process if accounts are claimed.
+
+    Processes that claim accounts may share a shard, so each keeps a journal of
+    its own, and takes over the journals of processes on its host that died.
+
+    :param shard: An optional `Shard`.
+    :param claims: Optional `Claims` through which accounts are claimed.
+    :return: A `Journal`.
+    """
+    path: str = default_path()
+    if shard:
+        path = shard.qualify(path)
+    if not claims:
+        return Journal(path)
+
+    journal: Journal = Journal(claims.qualify(path))
+    for orphan in claims.orphans(path):
+        journal.adopt(orphan)
+
+    return journal
+
+
+def _finish(
+    account: Account, future: Future, journal: Journal, pipeline: UploadPipeline
+) -> None:
+    """Journal an account's enrichment result and hand it to the uploader.
+
+    An account whose enrichment failed is logged and skipped.
+
+    :param account: An `Account` object.
+    :param future: The `Future` of the account's enrichment.
+    :param journal: The run's `Journal`.
+    :param pipeline: The run's `UploadPipeline`.
+    """
+    try:
+        contacts, company_info, summary = future.result()
+    except Exception as e:
+        error(f"Enrichment failure for {account.name}. {e}")
+        return
+
+    info(f"Data prepared for {account.name}.")
+
+    account.notes: str = "<br><br>".join([company_info, summary])
+    journal.record_enriched(account, contacts)
+    pipeline.add(account, contacts)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="oscr", description="Enrich Salesforce accounts with DiscoverOrg data."
+    )
+    parser.add_argument("--workers", type=int, help="concurrent enrichment workers")
+    parser.add_argument(
+        "--watch", action="store_true", help="keep polling for requested accounts"
+    )
+    parser.add_argument("--interval", type=float, help="seconds between polls")
+    parser.add_argument("--rescan", type=float, help="seconds between full scans")
+    parser.add_argument(
+        "--shard", type=_shard, help="enrich only shard i of N, given as i/N"
+    )
+    parser.add_argument(
+        "--claim-dir",
+        default=os.getenv("OSCR_CLAIM_DIR"),
+        help="directory of account claims shared by every process",
+    )
+    parser.add_argument("--claim-ttl", type=float, help="seconds a claim lasts")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="oscr-profile",
+        metavar="DIR",
+        help="profile the run, writing the profiles and a report to DIR",
+    )
+
+    return parser.parse_args(argv)
+
+
+def _shard(value: str) -> Shard:
+    """Parse a `--shard` argument."""
+    try:
+        return Shard.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def _enrich(sfc: SalesforceClient, doc: DiscoverOrgClient, account: Account):
+    """Enrich an account, attributing its metrics and profile to it."""
+    with METRICS.account(account.salesforce_id), PROFILER.account(
+        account.salesforce_id
+    ):
+        return enrich(sfc, doc, account)
 
 
 if __name__ == "__main__":
     getLogger().setLevel(INFO)
 
-    run()
+    args: argparse.Namespace = parse_args()
+    claims: Claims = Claims(args.claim_dir, args.claim_ttl) if args.claim_dir else None
+
+    if args.profile:
+        PROFILER.start(args.profile)
+
+    try:
+        if args.watch:
+            watch(
+                interval=args.interval,
+                rescan=args.rescan,
+                workers=args.workers,
+                shard=args.shard,
+                claims=claims,
+            )
+        else:
+            run(workers=args.workers, shard=args.shard, claims=claims)
+    finally:
+        PROFILER.stop()
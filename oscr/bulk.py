@@ -0,0 +1,359 @@
+"""
+oscr.bulk
+~~~~~~~~~
+
+This module implements a Salesforce Bulk API 2.0 write engine.
+"""
+
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from logging import info, warning
+from typing import Callable, Iterable, Iterator, Optional
+
+from oscr.metrics import METRICS
+
+import requests as rq
+
+RETRYABLE = {
+    "UNABLE_TO_LOCK_ROW",
+    "REQUEST_RUNNING_TOO_LONG",
+    "SERVER_UNAVAILABLE",
+    "UNPROCESSED",
+}
+
+FINISHED = {"JobComplete", "Failed", "Aborted"}
+
+
+@dataclass
+class BulkResult:
+    """Model the per-row outcome of a bulk write.
+
+    Succeeded rows carry their record ID in `sf__Id`, and failed rows carry
+    their error in `sf__Error`.
+    """
+
+    succeeded: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+
+
+class BulkWriter:
+    """Implement the `BulkWriter` class.
+
+    This class writes rows to Salesforce through Bulk API 2.0 ingest jobs. Rows
+    are serialized to CSV and split into batches, each submitted as its own job.
+    Jobs run in parallel, and each is polled until it finishes. The result of
+    every row is collected from the jobs' result sets, and only the rows that
+    failed for transient reasons, such as row locks, are retried.
+
+    The rows per job, jobs in parallel, retry attempts, and poll interval in
+    seconds may be set in the environment variables `SF_BULK_BATCH`,
+    `SF_BULK_CONCURRENCY`, `SF_BULK_RETRIES`, and `SF_BULK_POLL`.
+
+    If a `renew` callable is given, a request the API rejects for its session is
+    retried once, on the connection `renew` returns for the rejected one.
+    """
+
+    def __init__(self, api, renew: Callable = None):
+        self.api = api
+        self.renew: Callable = renew
+
+        self.batch_rows: int = int(os.getenv("SF_BULK_BATCH", 10000))
+        self.concurrency: int = int(os.getenv("SF_BULK_CONCURRENCY", 4))
+        self.retries: int = int(os.getenv("SF_BULK_RETRIES", 2))
+        self.poll: float = float(os.getenv("SF_BULK_POLL", 2))
+
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.concurrency
+        )
+
+    def insert(self, sobject: str, rows: Iterable[dict]) -> BulkResult:
+        """Insert rows of an sObject.
+
+        :param sobject: A `str` sObject name.
+        :param rows: An iterable of field `dict` objects.
+        :return: A `BulkResult`.
+        """
+        return self._write(sobject, "insert", rows)
+
+    def update(self, sobject: str, rows: Iterable[dict]) -> BulkResult:
+        """Update rows of an sObject by their `Id` fields.
+
+        :param sobject: A `str` sObject name.
+        :param rows: An iterable of field `dict` objects.
+        :return: A `BulkResult`.
+        """
+        return self._write(sobject, "update", rows)
+
+    def insert_csv(self, sobject: str, path: str) -> BulkResult:
+        """Insert the rows of a CSV file of an sObject.
+
+        :param sobject: A `str` sObject name.
+        :param path: The `str` path of a CSV file with a header row.
+        :return: A `BulkResult`.
+        """
+        with open(path, newline="") as f:
+            return self._write(sobject, "insert", csv.DictReader(f))
+
+    def _write(self, sobject: str, operation: str, rows: Iterable[dict]) -> BulkResult:
+        """Write rows in parallel jobs, retrying the rows that failed transiently.
+
+        :param sobject: A `str` sObject name.
+        :param operation: A `str` Bulk API 2.0 operation.
+        :param rows: An iterable of field `dict` objects.
+        :return: A `BulkResult`.
+        """
+        result: BulkResult = BulkResult()
+        attempt: int = 0
+
+        while True:
+            run_job = METRICS.bound(self._job)
+            futures: list = [
+                self._executor.submit(run_job, sobject, operation, batch)
+                for batch in _batches(rows, self.batch_rows)
+            ]
+
+            retry: list = []
+            for future in futures:
+                job: BulkResult = future.result()
+                result.succeeded.extend(job.succeeded)
+
+                for row in job.failed:
+                    code: str = row.get("sf__Error", "").split(":")[0]
+                    if code in RETRYABLE and attempt < self.retries:
+                        retry.append(
+                            {k: v for k, v in row.items() if not k.startswith("sf__")}
+                        )
+                    else:
+                        result.failed.append(row)
+
+            if not retry:
+                break
+
+            attempt += 1
+            info(f"Retrying {len(retry)} {sobject} rows (attempt {attempt}).")
+            METRICS.count("bulk_retried_rows", len(retry), client="salesforce")
+            rows = retry
+
+        METRICS.count("bulk_rows_succeeded", len(result.succeeded), client="salesforce")
+        METRICS.count("bulk_rows_failed", len(result.failed), client="salesforce")
+
+        return result
+
+    def _job(self, sobject: str, operation: str, rows: list) -> BulkResult:
+        """Run one ingest job to completion and collect its per-row results.
+
+        Rows are only reported as unprocessed, and so retried, when the job is
+        known never to have run. A job that can't be created, or whose upload
+        fails before it is marked complete, is aborted. Once a job has run, its
+        state and results are read again on failure, and if they still can't
+        be read, its rows are reported as unconfirmed, which isn't retried, so
+        that no row is ever written twice.
+
+        :param sobject: A `str` sObject name.
+        :param operation: A `str` Bulk API 2.0 operation.
+        :param rows: A `list` of field `dict` objects.
+        :return: A `BulkResult`.
+        """
+        base: str = f"{self.api.base_url}jobs/ingest/"
+
+        try:
+            job: dict = self._request(
+                "POST",
+                base,
+                json={
+                    "object": sobject,
+                    "operation": operation,
+                    "contentType": "CSV",
+                    "lineEnding": "LF",
+                },
+            ).json()
+            url: str = f"{base}{job['id']}/"
+        except (rq.RequestException, KeyError, ValueError) as e:
+            warning(f"Bulk {operation} job for {len(rows)} {sobject} rows failed. {e}")
+            return _failed(rows, "UNPROCESSED", e)
+
+        uploading: bool = False
+        try:
+            self._request(
+                "PUT",
+                f"{url}batches",
+                data=_to_csv(rows).encode("utf-8"),
+                headers={"Content-Type": "text/csv"},
+            )
+            uploading = True
+            self._request("PATCH", url, json={"state": "UploadComplete"})
+        except rq.RequestException as e:
+            state: str = self._state(url) if uploading else "Open"
+            if state == "Open":
+                warning(f"Bulk {operation} job {job['id']} upload failed. {e}")
+                self._abort(url)
+                return _failed(rows, "UNPROCESSED", e)
+            if state is None:
+                warning(f"Bulk {operation} job {job['id']} is in an unknown state.")
+                return _failed(rows, "UNCONFIRMED", e)
+
+        try:
+            delay: float = self.poll
+            while True:
+                state: str = self._reliably("GET", url).json()["state"]
+                if state in FINISHED:
+                    break
+
+                time.sleep(delay)
+                delay = min(delay * 1.5, 30)
+
+            if state != "JobComplete":
+                warning(f"Bulk {operation} job {job['id']} ended as {state}.")
+
+            result: BulkResult = BulkResult(
+                succeeded=self._results(f"{url}successfulResults"),
+                failed=self._results(f"{url}failedResults"),
+            )
+            for row in self._results(f"{url}unprocessedrecords"):
+                row["sf__Error"] = "UNPROCESSED:The job ended before this row ran."
+                result.failed.append(row)
+        except (rq.RequestException, KeyError, ValueError) as e:
+            warning(f"Couldn't read the results of bulk job {job['id']}. {e}")
+            return _failed(rows, "UNCONFIRMED", e)
+
+        return result
+
+    def _state(self, url: str) -> Optional[str]:
+        """Get the state of a job.
+
+        :param url: The `str` URL of the job.
+        :return: The `str` state, or `None` if it can't be read.
+        """
+        try:
+            return self._reliably("GET", url).json()["state"]
+        except (rq.RequestException, KeyError, ValueError):
+            return None
+
+    def _abort(self, url: str) -> None:
+        """Abort a job that hasn't run, so that it never does.
+
+        :param url: The `str` URL of the job.
+        """
+        try:
+            self._request("PATCH", url, json={"state": "Aborted"})
+        except rq.RequestException as e:
+            warning(f"Couldn't abort the bulk job at {url}. {e}")
+
+    def _results(self, url: str) -> list:
+        """Get a job's result set as rows.
+
+        :param url: The `str` URL of the result set.
+        :return: A `list` of field `dict` objects.
+        """
+        text: str = self._reliably("GET", url, headers={"Accept": "text/csv"}).text
+
+        return list(csv.DictReader(io.StringIO(text)))
+
+    def _reliably(self, method: str, url: str, **kwargs):
+        """Send a request that is safe to repeat, retrying it on failure.
+
+        :param method: A `str` HTTP method.
+        :param url: A `str` URL.
+        :return: A successful `rq.Response`.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._request(method, url, **kwargs)
+            except rq.RequestException:
+                if attempt == self.retries:
+                    raise
+
+            time.sleep(self.poll * 2 ** attempt)
+
+    def _request(self, method: str, url: str, headers: dict = None, **kwargs):
+        """Send an authenticated request to the API.
+
+        :param method: A `str` HTTP method.
+        :param url: A `str` URL.
+        :param headers: An optional `dict` of extra headers.
+        :return: A successful `rq.Response`.
+        """
+        for attempt in range(2):
+            api = self.api
+            merged: dict = dict(api.headers)
+            merged.update(headers or {})
+
+            response: rq.Response = api.session.request(
+                method, url, headers=merged, **kwargs
+            )
+            METRICS.count("requests", client="salesforce")
+
+            if response.status_code != 401 or not self.renew or attempt:
+                break
+
+            self.api = self.renew(api)
+
+        response.raise_for_status()
+
+        return response
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[list]:
+    """Split rows into lists of a given size.
+
+    :param rows: An iterable of field `dict` objects.
+    :param size: The `int` number of rows per list.
+    """
+    rows: Iterator = iter(rows)
+    while True:
+        batch: list = list(islice(rows, size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def _failed(rows: list, code: str, reason: Exception) -> BulkResult:
+    """Report every row of a job as failed.
+
+    :param rows: A `list` of field `dict` objects.
+    :param code: The `str` error code of the rows.
+    :param reason: The `Exception` the job failed with.
+    :return: A `BulkResult`.
+    """
+    message: str = f"{code}:{reason}".replace("\n", " ")
+
+    return BulkResult(failed=[dict(row, sf__Error=message) for row in rows])
+
+
+def _to_csv(rows: list) -> str:
+    """Serialize rows for an ingest job.
+
+    :param rows: A `list` of field `dict` objects.
+    :return: A `str` CSV document.
+    """
+    fields: list = list(dict.fromkeys(key for row in rows for key in row))
+
+    buffer: io.StringIO = io.StringIO()
+    writer: csv.DictWriter = csv.DictWriter(
+        buffer, fieldnames=fields, lineterminator="\n"
+    )
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: _to_cell(v) for k, v in row.items()})
+
+    return buffer.getvalue()
+
+
+def _to_cell(value) -> str:
+    """Format a field value as a Bulk API 2.0 CSV cell.
+
+    :param value: A field value.
+    :return: A `str` cell.
+    """
+    if value is None:
+        return ""
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    else:
+        return str(value)
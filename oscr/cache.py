@@ -0,0 +1,131 @@
+"""
+oscr.cache
+~~~~~~~~~~
+
+This module implements a persistent response cache for API clients.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class ResponseCache:
+    """Implement the `ResponseCache` class.
+
+    This class stores response bodies in a SQLite database, keyed by a digest of
+    the request that produced them. Entries expire after a time to live, and the
+    least recently used entries are evicted once the cache outgrows its size.
+
+    Its location, time to live in seconds, and maximum number of entries may be
+    set in the environment variables `DO_CACHE_PATH`, `DO_CACHE_TTL`, and
+    `DO_CACHE_SIZE`. If `DO_CACHE_BYPASS` is set, cached entries are never read,
+    but fresh responses are still stored.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ttl: int = None,
+        size: int = None,
+        bypass: bool = None,
+    ):
+        self.path: str = path or os.getenv(
+            "DO_CACHE_PATH",
+            os.path.join(os.path.expanduser("~"), ".oscr", "discoverorg.sqlite3"),
+        )
+        self.ttl: int = ttl or int(os.getenv("DO_CACHE_TTL", 7 * 24 * 60 * 60))
+        self.size: int = size or int(os.getenv("DO_CACHE_SIZE", 10000))
+        self.bypass: bool = (
+            bypass
+            if bypass is not None
+            else os.getenv("DO_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+        )
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self._lock: threading.Lock = threading.Lock()
+        self._writes: int = 0
+        self._db: sqlite3.Connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Digest the parts of a request into a cache key.
+
+        :param parts: The `str` parts of a normalized request.
+        :return: A `str` cache key.
+        """
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a live entry.
+
+        :param key: A `str` cache key.
+        :return: The `str` cached value, or `None` on a miss.
+        """
+        if self.bypass:
+            return None
+
+        now: float = time.time()
+        with self._lock:
+            row: tuple = self._db.execute(
+                "SELECT value FROM entries WHERE key = ? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+            )
+
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Store an entry, evicting the least recently used ones if needed.
+
+        :param key: A `str` cache key.
+        :param value: A `str` value.
+        """
+        now: float = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries and any beyond the size bound."""
+        self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            """
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.size,),
+        )
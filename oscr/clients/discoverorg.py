@@ -7,12 +7,29 @@ This module contains a high-level DiscoverOrg API client class.
 
 import json
 import os
-import time
+import random
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from logging import info, warning
+from typing import Generator, Iterable, Iterator, Optional, Tuple
 
+from oscr.bias import FUNCTION_BIAS
+from oscr.cache import ResponseCache
+from oscr.metrics import METRICS
 from oscr.models import Account, Contact
+from oscr.ratelimit import RateLimiter
+from oscr.tokens import TokenStore
 
 import requests as rq
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+EMPLOYEES_PER_PAGE = 1000
+
+PERSON_FIELDS = ["fullName", "title", "officeTelNumber", "mobileTelNumber", "email"]
 
 
 class DiscoverOrgClient:
@@ -23,37 +40,375 @@ class DiscoverOrgClient:
 
     It requires the presence of a username, password, and partner key in order to
     start a session with the API. Those values must be stored in environment variables
-    `DO_USERNAME`, `DO_PASSWORD`, and `DO_KEY`, respectively.
+    `DO_USERNAME`, `DO_PASSWORD`, and `DO_KEY`, respectively. The API's base URL
+    may be overridden in `DO_BASE_URL`.
+
+    Requests are paced by a `RateLimiter` shared with every other client on the
+    host, so the API's quota is respected before a 429 is ever returned. A
+    request that is still rate limited is retried up to `DO_RATE_LIMIT_RETRIES`
+    times in a row.
+
+    All requests go through one pooled keep-alive `rq.Session`. Its pool size,
+    retry count, and timeout in seconds per attempt may be set in the
+    environment variables `DO_POOL_SIZE`, `DO_RETRIES`, and `DO_TIMEOUT`.
+    Server errors and dropped connections are retried with jittered exponential
+    backoff, and an expired session key is renewed automatically.
+
+    Search results are kept in a persistent `ResponseCache`, keyed by the
+    normalized request, so repeated and sibling accounts don't pay for the same
+    lookups twice. Within a run, identical searches in flight at once are also
+    sent only once, and the results of the last `DO_RECENT_SIZE` searches are
+    kept in memory, which holds even when the cache is bypassed.
+
+    The pages of a person search are fetched concurrently, by a pool whose size
+    may be set in the environment variable `DO_PAGE_WORKERS`. No more pages than
+    that are requested ahead of the consumer, so a consumer that stops reading
+    early spares the requests for the pages it never reached.
+
+    If the environment variable `DO_SERVER_FILTER` is set, person searches also
+    ask the API for only the people whose titles name a `FUNCTION_BIAS` function
+    and who have an email address, and for only the fields OSCR reads. Should the
+    API reject those criteria with a 400 or 422, the client falls back to
+    unfiltered searches.
+
+    The client only logs in when its first request is sent. Its session key is
+    kept in the `TokenStore` for the number of seconds in the environment
+    variable `DO_SESSION_TTL`, so that later runs reuse it instead of logging in.
     """
 
     def __init__(self):
-        self.base: str = "https://papi.discoverydb.com/papi"
+        self.base: str = os.getenv("DO_BASE_URL", "https://papi.discoverydb.com/papi")
 
         self.username: str = os.getenv("DO_USERNAME")
         self.password: str = os.getenv("DO_PASSWORD")
         self.key: str = os.getenv("DO_KEY")
 
-        self.session: str = self._get_session()
+        self.server_filter: bool = bool(os.getenv("DO_SERVER_FILTER"))
+
+        self.limiter: RateLimiter = RateLimiter()
+        self.rate_limit_retries: int = int(os.getenv("DO_RATE_LIMIT_RETRIES", 5))
+        self.cache: ResponseCache = ResponseCache()
+
+        self._companies: dict = {}
+        self._companies_lock: threading.Lock = threading.Lock()
+
+        self.recent_size: int = int(os.getenv("DO_RECENT_SIZE", 256))
+        self._flights: dict = {}
+        self._recent: OrderedDict = OrderedDict()
+        self._flights_lock: threading.Lock = threading.Lock()
+        self.http: rq.Session = self._get_http()
+        self.timeout: float = float(os.getenv("DO_TIMEOUT", 30))
+        self.page_workers: int = int(os.getenv("DO_PAGE_WORKERS", 4))
+        self._pages: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.page_workers
+        )
+
+        self.tokens: TokenStore = TokenStore()
+        self.session_ttl: float = float(os.getenv("DO_SESSION_TTL", 3600))
+
+        self._login_lock: threading.Lock = threading.Lock()
+        self.session: str = None
+
+    def _get_http(self) -> rq.Session:
+        """Build a pooled HTTP session with transport-level retries.
+
+        :return: A configured `rq.Session`.
+        """
+        pool_size: int = int(os.getenv("DO_POOL_SIZE", 16))
+        retries: _JitteredRetry = _JitteredRetry(
+            total=int(os.getenv("DO_RETRIES", 5)),
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+        )
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+        )
+
+        http: rq.Session = rq.Session()
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        http.headers.update(
+            {
+                "X-PARTNER-KEY": self.key,
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            }
+        )
+
+        return http
 
     def _get_session(self) -> str:
         """Get a session key.
 
+        The key is also set on the HTTP session, so that every later request
+        carries it.
+
         :return: A `str` session key.
         """
         url: str = "".join([self.base, "/login"])
-        headers: dict = {"Content-Type": "application/json"}
         data: dict = {
             "username": self.username,
             "password": self.password,
             "partnerKey": self.key,
         }
 
-        response: rq.Response = rq.post(url, headers=headers, data=json.dumps(data))
+        response: rq.Response = self.http.post(
+            url,
+            data=json.dumps(data),
+            headers={"X-AUTH-TOKEN": None},
+            timeout=self.timeout,
+        )
+        METRICS.count("logins", client="discoverorg")
 
         session: str = response.headers.get("X-AUTH-TOKEN")
+        self.http.headers["X-AUTH-TOKEN"] = session
+
+        if session:
+            self.tokens.set(self._token_name, {"token": session}, self.session_ttl)
 
         return session
 
+    @property
+    def _token_name(self) -> str:
+        return f"discoverorg:{self.base}:{self.username}"
+
+    def _ensure_session(self) -> None:
+        """Reuse a stored session key, or log in, unless the client has a key."""
+        if self.session is not None:
+            return
+
+        with self._login_lock:
+            if self.session is not None:
+                return
+
+            stored: dict = self.tokens.get(self._token_name)
+            if stored:
+                METRICS.count("session_reuses", client="discoverorg")
+                self.http.headers["X-AUTH-TOKEN"] = stored["token"]
+                self.session = stored["token"]
+            else:
+                self.session = self._get_session()
+
+    def _refresh_session(self, expired: str) -> None:
+        """Renew the session key, unless another thread already has.
+
+        :param expired: The `str` session key that was rejected.
+        """
+        with self._login_lock:
+            if self.session == expired:
+                info("DiscoverOrg session expired. Logging in again.")
+                self.tokens.discard(self._token_name)
+                self.session = self._get_session()
+
+    def _post(self, url: str, data: str) -> rq.Response:
+        """Send a rate limited POST request.
+
+        A 429 response should be rare, since the limiter learns the quota from
+        every response. If one still arrives, the limiter is told the quota is
+        spent and the request is retried once the window resets, or, if the
+        response doesn't say when that is, after an exponential backoff. A 401
+        response renews the session key and retries the request once.
+
+        :param url: A `str` URL.
+        :param data: A `str` JSON request body.
+        :return: The final `rq.Response` to the request.
+        """
+        renewed: bool = False
+        limited: int = 0
+        while True:
+            waited: float = self.limiter.acquire()
+            METRICS.count("rate_limit_sleep_seconds", waited, client="discoverorg")
+
+            self._ensure_session()
+            session: str = self.session
+            response: rq.Response = self.http.post(
+                url, data=data, timeout=self.timeout
+            )
+
+            retries: Retry = getattr(response.raw, "retries", None)
+            METRICS.count("requests", client="discoverorg")
+            METRICS.count("bytes", len(response.content), client="discoverorg")
+            METRICS.count(
+                "retries", len(retries.history) if retries else 0, client="discoverorg"
+            )
+
+            if response.status_code == 429:
+                METRICS.count("rate_limited", client="discoverorg")
+                limited += 1
+                if limited > self.rate_limit_retries:
+                    warning(f"Rate limited {limited} times in a row. Giving up.")
+                    return response
+
+                info("Rate limit reached. Waiting for the quota to reset.")
+                self.limiter.update(
+                    response.headers, exhausted=True, backoff=min(2 ** limited, 60)
+                )
+                continue
+
+            self.limiter.update(response.headers)
+
+            if response.status_code == 401 and not renewed:
+                self._refresh_session(session)
+                renewed = True
+                continue
+
+            return response
+
+    def _search(self, url: str, body: dict, stage: str) -> Optional[dict]:
+        """Run a search, serving it from the cache when possible.
+
+        :param url: A `str` search URL.
+        :param body: A `dict` of search criteria.
+        :param stage: The `str` name under which the search is timed.
+        :return: The decoded `dict` response, or `None` if the search failed.
+        """
+        return self._search_status(url, body, stage)[1]
+
+    def _search_status(
+        self, url: str, body: dict, stage: str
+    ) -> Tuple[int, Optional[dict]]:
+        """Run a search, and report the status code of its response.
+
+        Identical searches are coalesced: while one is in flight, any other
+        thread running it waits for its result instead of sending its own, and
+        the most recent results are kept in memory for later callers.
+
+        :param url: A `str` search URL.
+        :param body: A `dict` of search criteria.
+        :param stage: The `str` name under which the search is timed.
+        :return: A `tuple` of the `int` status code, which is 200 for results
+                 served from memory or the cache, and the decoded `dict`
+                 response, or `None` if the search failed.
+        """
+        key: str = self.cache.key(url, json.dumps(_canonical(body), sort_keys=True))
+
+        with METRICS.timer(stage):
+            status: int = 200
+            with self._flights_lock:
+                text: str = self._recent.get(key)
+                if text is not None:
+                    self._recent.move_to_end(key)
+                else:
+                    flight: Future = self._flights.get(key)
+                    leader: bool = flight is None
+                    if leader:
+                        flight = self._flights[key] = Future()
+
+            if text is not None:
+                METRICS.count("coalesced", client="discoverorg")
+            elif not leader:
+                METRICS.count("coalesced", client="discoverorg")
+                status, text = flight.result()
+            else:
+                try:
+                    status, text = self._fetch(url, body, key)
+                except BaseException as e:
+                    flight.set_exception(e)
+                    raise
+                else:
+                    flight.set_result((status, text))
+                finally:
+                    with self._flights_lock:
+                        del self._flights[key]
+                        if text is not None:
+                            self._recent[key] = text
+                            while len(self._recent) > self.recent_size:
+                                self._recent.popitem(last=False)
+
+            return status, json.loads(text) if text is not None else None
+
+    def _fetch(self, url: str, body: dict, key: str) -> Tuple[int, Optional[str]]:
+        """Get the text of a search result from the cache, or from the API.
+
+        :param url: A `str` search URL.
+        :param body: A `dict` of search criteria.
+        :param key: The `str` cache key of the search.
+        :return: A `tuple` of the `int` status code, and the `str` response body,
+                 or `None` if the search failed.
+        """
+        text: str = self.cache.get(key)
+        if text is not None:
+            METRICS.count("cache_hits", client="discoverorg")
+            return 200, text
+
+        response: rq.Response = self._post(url, data=json.dumps(body))
+        if response.status_code != 200:
+            return response.status_code, None
+
+        self.cache.set(key, response.text)
+
+        return 200, response.text
+
+    def get_companies(self, ids: Iterable[str]) -> dict:
+        """Get the company records of many DiscoverOrg IDs.
+
+        The IDs are looked up in batches, whose size may be set in the environment
+        variable `DO_COMPANY_BATCH`, and the records found are also kept for
+        `get_company_info`.
+
+        :param ids: An iterable of `str` DiscoverOrg company IDs.
+        :return: A `dict` of company records, keyed by their `str` IDs.
+        """
+        url: str = "".join([self.base, "/v1/search/companies"])
+        ids: list = list(dict.fromkeys(ids))
+        size: int = int(os.getenv("DO_COMPANY_BATCH", 25))
+
+        companies: dict = {}
+        for start in range(0, len(ids), size):
+            chunk: list = ids[start : start + size]
+            body: dict = {"companyCriteria": {"companyIds": chunk}}
+
+            for data in self._get_pages(url, body, "do.get_companies"):
+                if data is None:
+                    warning(f"Couldn't retrieve {len(chunk)} company records by ID.")
+                    break
+
+                for record in data.get("content", []):
+                    companies[str(record.get("id"))] = record
+
+        with self._companies_lock:
+            self._companies.update(companies)
+
+        return companies
+
+    def prefetch_companies(self, accounts: Iterable[Account]) -> None:
+        """Load the company records of every account with a DiscoverOrg ID.
+
+        :param accounts: An iterable of `Account` objects.
+        """
+        ids: list = [_discoverorg_id(account) for account in accounts]
+
+        self.get_companies(i for i in ids if i)
+
+    def estimate_cost(self, account: Account) -> Optional[float]:
+        """Estimate how many person pages an account's enrichment will fetch.
+
+        The number of pages a search of the account's website returned before is
+        kept in the cache. Failing that, it is estimated from the company size
+        in a record loaded by `prefetch_companies`.
+
+        :param account: An `Account` object.
+        :return: A `float` number of pages, or `None` if nothing is known.
+        """
+        pages: str = self.cache.get(self._pages_key(account))
+        if pages is not None:
+            return float(pages)
+
+        with self._companies_lock:
+            record: dict = self._companies.get(_discoverorg_id(account))
+
+        employees = (record or {}).get("numEmployees")
+        if isinstance(employees, (int, float)) and employees > 0:
+            return float(min(max(employees // EMPLOYEES_PER_PAGE, 1), 11))
+
+        return None
+
+    def _pages_key(self, account: Account) -> str:
+        return self.cache.key("pages", _normalize_domain(account.domain))
+
+    @METRICS.timed("do.get_company_info")
     def get_company_info(self, account: Account) -> str:
         """Get company information for a given account.
 
@@ -67,36 +422,39 @@ class DiscoverOrgClient:
         These values are formatted into a Salesforce field-friendly string
         by a separate utility method.
 
+        An account with a DiscoverOrg ID is looked up directly by that ID, and
+        served from the records loaded by `prefetch_companies` if possible. Only
+        accounts without an ID, or whose ID isn't found, fall back to a search
+        by name and website.
+
         :param account: An `Account` object.
         """
+        company_id: str = _discoverorg_id(account)
+        if company_id:
+            with self._companies_lock:
+                record: dict = self._companies.pop(company_id, None)
+
+            if record is None:
+                record: dict = self.get_companies([company_id]).get(company_id)
+                with self._companies_lock:
+                    self._companies.pop(company_id, None)
+
+            if record is not None:
+                return record
+
         url: str = "".join([self.base, "/v1/search/companies"])
-        headers: dict = {
-            "X-PARTNER-KEY": self.key,
-            "X-AUTH-TOKEN": self.session,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        data: str = json.dumps(
-            {
-                "companyCriteria": {
-                    "queryString": account.name,
-                    "queryStringApplication": ["NAME"],
-                    "websiteUrls": [account.domain],
-                }
+        body: dict = {
+            "companyCriteria": {
+                "queryString": account.name,
+                "queryStringApplication": ["NAME"],
+                "websiteUrls": [account.domain],
             }
-        )
+        }
 
-        response: rq.Response = rq.post(url, headers=headers, data=data)
+        data: dict = self._search(url, body, "do.search_companies")
 
-        if response.status_code == 200:
-            data: dict = json.loads(response.text)
+        if data is not None:
             records: list = data.get("content", [])
-        elif response.status_code == 429:
-            wait = int(response.headers.get("X-Rate-Limit-Reset")) - time.time()
-            info(f"Rate limit reached. Cooling for {wait} seconds.")
-            time.sleep(int(wait))
-            info("Cooling complete. Continuing retrieval.")
-            self.get_company_info(account)
         else:
             warning(f"Couldn't retrieve company info records for {account.name}.")
             records: list = []
@@ -106,63 +464,234 @@ class DiscoverOrgClient:
         else:
             return None
 
-    def get_contacts(self, account: Account) -> Contact:
+    def get_contacts(self, account: Account) -> Generator[Contact, None, None]:
         """Yield a generator of available contacts for a given account.
 
         This method contains a regular expression to stop the yielding of contacts
         whose email addresses aren't on the exact domain of the account, but might
         be substrings of that domain.
 
+        Contacts are yielded page by page, as soon as each page is retrieved.
+
         :param account: An `Account` object.
         """
         base: str = "".join([self.base, "/v1/search/persons"])
-        headers: dict = {
-            "X-PARTNER-KEY": self.key,
-            "X-AUTH-TOKEN": self.session,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        body: str = json.dumps({"companyCriteria": {"websiteUrls": [account.domain]}})
-        page: int = 0
+        body: dict = {"companyCriteria": {"websiteUrls": [account.domain]}}
 
-        records: list = []
-        while True and page <= 10:
-            url: str = f"{base}?pageNumber={page}"
+        if self.server_filter:
+            filtered: dict = dict(body, **_person_criteria())
+            status, first = self._search_status(
+                f"{base}?pageNumber=0", filtered, "do.search_persons"
+            )
+            if first is None:
+                pages: Iterator = self._get_unfiltered_pages(
+                    base, body, account, status
+                )
+            else:
+                pages: Iterator = self._get_pages(
+                    base, filtered, "do.search_persons", first
+                )
+        else:
+            pages: Iterator = self._get_pages(base, body, "do.search_persons")
 
-            response: rq.Response = rq.post(url=url, headers=headers, data=body)
+        for data in pages:
+            if data is None:
+                warning(f"Couldn't retrieve contact records for {account.name}.")
+                return
+
+            if data.get("number", 0) == 0 and data.get("totalPages") is not None:
+                total: int = min(data["totalPages"], 11)
+                self.cache.set(self._pages_key(account), str(total))
+
+            for record in data.get("content", []):
+                yield Contact(
+                    account=account.salesforce_id,
+                    salesforce_id="",
+                    name=record.get("fullName", ""),
+                    title=record.get("title", ""),
+                    office=account.phone,
+                    direct=record.get("officeTelNumber", ""),
+                    mobile=record.get("mobileTelNumber", ""),
+                    email=record.get("email", ""),
+                    rating=10,
+                    priority=10,
+                    status="new",
+                )
+
+    def _get_unfiltered_pages(
+        self, base: str, body: dict, account: Account, status: int
+    ) -> Generator[Optional[dict], None, None]:
+        """Yield the pages of a person search whose filtered form failed.
+
+        If the filtered search was answered with a 400 or 422 and the unfiltered
+        search succeeds, the API rejected the filter criteria rather than the
+        search, so later searches go unfiltered too. Any other failure, such as
+        a server error or a rate limit, leaves the filter on.
+
+        :param base: A `str` search URL.
+        :param body: A `dict` of unfiltered search criteria.
+        :param account: The `Account` object being searched for.
+        :param status: The `int` status code of the filtered search.
+        """
+        info(f"Filtered person search failed for {account.name}. Retrying unfiltered.")
+        pages: Iterator = self._get_pages(base, body, "do.search_persons")
+
+        first: dict = next(pages)
+        if first is not None and status in (400, 422) and self.server_filter:
+            warning("DiscoverOrg rejected the person filter. Disabling it.")
+            self.server_filter = False
+
+        yield first
+        yield from pages
+
+    def _get_pages(
+        self, base: str, body: dict, stage: str, first: dict = None
+    ) -> Generator[Optional[dict], None, None]:
+        """Yield the pages of a paginated search, in order.
+
+        The first page reports how many pages there are, so the rest (up to the
+        eleventh) are fetched concurrently on the client's page pool, keeping a
+        window of `page_workers` requests ahead of the consumer. If it doesn't,
+        pages are fetched one at a time until the last is reached.
+
+        If a page can't be retrieved, `None` is yielded in its place and no
+        further pages are.
+
+        :param base: A `str` search URL.
+        :param body: A `dict` of search criteria.
+        :param stage: The `str` name under which each page is timed.
+        :param first: The `dict` first page, if it was already retrieved.
+        """
+        data: dict = first
+        if data is None:
+            data = self._search(f"{base}?pageNumber=0", body, stage)
 
-            if response.status_code == 200:
-                data: dict = json.loads(response.text)
-                records.extend(data.get("content", []))
+        yield data
 
-                if data["last"] is False:
-                    page += 1
-                    continue
-                else:
-                    break
-            elif response.status_code == 429:
-                wait = abs(int(response.headers.get("X-Rate-Limit-Reset")))
-                info(f"Rate limit reached. Cooling for {wait} seconds.")
-                time.sleep(int(wait))
-                info("Cooling complete. Continuing retrieval.")
-                continue
-            else:
-                warning(f"Couldn't retrieve contact records for {account.name}.")
-                break
-
-        while records:
-            record: dict = records.pop(0)
-
-            yield Contact(
-                account=account.salesforce_id,
-                salesforce_id="",
-                name=record.get("fullName", ""),
-                title=record.get("title", ""),
-                office=account.phone,
-                direct=record.get("officeTelNumber", ""),
-                mobile=record.get("mobileTelNumber", ""),
-                email=record.get("email", ""),
-                rating=10,
-                priority=10,
-                status="new",
+        if data is None or data.get("last") is not False:
+            return
+
+        total: int = data.get("totalPages")
+        if total is None:
+            page: int = 1
+            while page <= 10:
+                data: dict = self._search(f"{base}?pageNumber={page}", body, stage)
+
+                yield data
+
+                if data is None or data.get("last") is not False:
+                    return
+
+                page += 1
+
+            return
+
+        search = METRICS.bound(self._search)
+        pages: Iterator[int] = iter(range(1, min(total, 11)))
+        futures: deque = deque(
+            self._pages.submit(search, f"{base}?pageNumber={page}", body, stage)
+            for page in islice(pages, self.page_workers)
+        )
+        try:
+            while futures:
+                data: dict = futures.popleft().result()
+
+                yield data
+
+                if data is None:
+                    return
+
+                for page in islice(pages, 1):
+                    futures.append(
+                        self._pages.submit(
+                            search, f"{base}?pageNumber={page}", body, stage
+                        )
+                    )
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _discoverorg_id(account: Account) -> Optional[str]:
+    """Get an account's DiscoverOrg company ID in a canonical form.
+
+    Salesforce may return the ID as a number, so it is normalized to the `str`
+    of an integer where possible.
+
+    :param account: An `Account` object.
+    :return: A `str` DiscoverOrg ID, or `None` if the account has none.
+    """
+    value = account.discoverorg_id
+    if value is None or str(value).strip() == "":
+        return None
+
+    try:
+        return str(int(float(value)))
+    except ValueError:
+        return str(value).strip()
+
+
+def _person_criteria() -> dict:
+    """Build the server-side part of a filtered person search.
+
+    :return: A `dict` of person criteria and the fields to return.
+    """
+    return {
+        "personCriteria": {
+            "queryString": " OR ".join(f'"{f}"' for f in FUNCTION_BIAS),
+            "queryStringApplication": ["TITLE"],
+            "emailAvailable": True,
+        },
+        "fields": PERSON_FIELDS,
+    }
+
+
+def _canonical(value):
+    """Normalize search criteria so that equivalent searches share a cache key.
+
+    Website URLs are reduced to their bare lowercase host, and query strings are
+    case-folded with their whitespace collapsed.
+
+    :param value: A search criteria `dict`, or any value nested within one.
+    :return: The normalized value.
+    """
+    if isinstance(value, dict):
+        return {
+            key: (
+                [_normalize_domain(url) for url in item]
+                if key == "websiteUrls"
+                else " ".join(item.split()).casefold()
+                if key == "queryString" and isinstance(item, str)
+                else _canonical(item)
             )
+            for key, item in value.items()
+        }
+    elif isinstance(value, list):
+        return [_canonical(item) for item in value]
+    else:
+        return value
+
+
+def _normalize_domain(url: str) -> str:
+    """Reduce a website URL to its bare lowercase host.
+
+    :param url: A `str` website URL.
+    :return: A `str` host name, without any scheme, `www.` prefix, or path.
+    """
+    hosts: list = re.findall(
+        r"^(?:https?://)?(?:[^@/\n]+@)?(?:www\.)?([^:/?\n]+)",
+        (url or "").strip().lower(),
+    )
+
+    return hosts[0] if hosts else ""
+
+
+class _JitteredRetry(Retry):
+    """Implement a `Retry` policy with full-jitter exponential backoff.
+
+    Randomizing each backoff keeps concurrent workers that failed together
+    from retrying in lockstep.
+    """
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
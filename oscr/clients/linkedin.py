@@ -8,8 +8,10 @@ This is an incomplete experimental module. It should not be used in production.
 """
 
 import os
+from typing import TYPE_CHECKING
 
-from selenium import webdriver
+if TYPE_CHECKING:
+    from selenium import webdriver
 
 
 class LinkedInClient:
@@ -20,7 +22,9 @@ class LinkedInClient:
     """
 
     def __init__(self, username: str = None, password: str = None):
-        self.driver: webdriver = webdriver.Chrome()
+        from selenium import webdriver
+
+        self.driver: "webdriver.Chrome" = webdriver.Chrome()
 
         username: str = username or os.getenv("LI_USERNAME")
         password: str = password or os.getenv("LI_PASSWORD")
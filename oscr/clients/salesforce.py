@@ -6,12 +6,19 @@ This module contains a high-level Salesforce API client class.
 """
 
 import os
-from logging import error
-from typing import Generator
+import re
+import threading
+import time
+from logging import error, info
+from typing import TYPE_CHECKING, Generator, Iterable, Iterator
 
+from oscr.bulk import BulkResult, BulkWriter
+from oscr.metrics import METRICS
 from oscr.models import Account, Contact
+from oscr.tokens import TokenStore
 
-import simple_salesforce as ss
+if TYPE_CHECKING:
+    import simple_salesforce as ss
 
 
 class SalesforceClient:
@@ -23,41 +30,143 @@ class SalesforceClient:
     It requires the presence of a username, password, token, and organization ID
     in order to authenticate properly with the API. Those values must be stored in
     environment variables `SF_USERNAME`, `SF_PASSWORD`, `SF_TOKEN`, and `SF_ORG_ID`
-    respectively.
+    respectively. An already authenticated `api` may be given instead.
+
+    Existing contacts may be loaded for many accounts at once with
+    `prefetch_contacts`, after which `get_contacts` serves those accounts from
+    memory instead of querying Salesforce once per account.
+
+    Writes go through a Bulk API 2.0 `BulkWriter`, and every row that still fails
+    after its retries is logged with its error.
+
+    The client only connects, and `simple_salesforce` is only imported, when the
+    API is first used. Its session is kept in the `TokenStore` for the number of
+    seconds in the environment variable `SF_SESSION_TTL`, so that later runs
+    reuse it instead of logging in. A session the API rejects is renewed.
     """
 
-    def __init__(self):
-        self.api: ss.Salesforce = ss.Salesforce(
+    def __init__(self, api: "ss.Salesforce" = None):
+        self._api: "ss.Salesforce" = api
+        self._bulk: BulkWriter = None
+        self._api_lock: threading.RLock = threading.RLock()
+
+        self.tokens: TokenStore = TokenStore()
+        self.session_ttl: float = float(os.getenv("SF_SESSION_TTL", 7200))
+
+        self._contacts: dict = {}
+        self._contacts_lock: threading.Lock = threading.Lock()
+
+    @property
+    def api(self) -> "ss.Salesforce":
+        """Get the API connection, connecting on first use."""
+        if self._api is None:
+            with self._api_lock:
+                if self._api is None:
+                    self._api = self._connect(reuse=True)
+
+        return self._api
+
+    @property
+    def bulk(self) -> BulkWriter:
+        """Get the bulk write engine, creating it on first use."""
+        if self._bulk is None:
+            with self._api_lock:
+                if self._bulk is None:
+                    self._bulk = BulkWriter(self.api, renew=self._renew)
+
+        return self._bulk
+
+    @property
+    def _token_name(self) -> str:
+        return f"salesforce:{os.getenv('SF_USERNAME')}"
+
+    def _connect(self, reuse: bool) -> "ss.Salesforce":
+        """Connect to the API with a stored session, or by logging in.
+
+        :param reuse: Whether a stored session may be used.
+        :return: A `ss.Salesforce` connection.
+        """
+        import simple_salesforce as ss
+
+        stored: dict = self.tokens.get(self._token_name) if reuse else None
+        if stored:
+            METRICS.count("session_reuses", client="salesforce")
+            return ss.Salesforce(
+                session_id=stored["session_id"], instance_url=stored["instance_url"]
+            )
+
+        api: ss.Salesforce = ss.Salesforce(
             username=os.getenv("SF_USERNAME"),
             password=os.getenv("SF_PASSWORD"),
             security_token=os.getenv("SF_TOKEN"),
             organizationId=os.getenv("SF_ORG_ID"),
         )
+        METRICS.count("logins", client="salesforce")
+
+        self.tokens.set(
+            self._token_name,
+            {
+                "session_id": api.session_id,
+                "instance_url": f"https://{api.sf_instance}",
+            },
+            self.session_ttl,
+        )
+
+        return api
 
-    def get_accounts(self) -> Generator[Account, None, None]:
+    def _renew(self, expired: "ss.Salesforce") -> "ss.Salesforce":
+        """Log in again, unless another thread already has.
+
+        :param expired: The `ss.Salesforce` connection whose session was rejected.
+        :return: A `ss.Salesforce` connection with a new session.
+        """
+        with self._api_lock:
+            if self._api is expired:
+                info("Salesforce session expired. Logging in again.")
+                self.tokens.discard(self._token_name)
+                self._api = self._connect(reuse=False)
+                if self._bulk is not None:
+                    self._bulk.api = self._api
+
+        return self._api
+
+    def get_accounts(
+        self, since: str = None, limit: int = None
+    ) -> Generator[Account, None, None]:
         """Yield a generator of all accounts where enrichment is requested.
 
         This method, if no `Enrichment_Requested_By__c` value is present,
         requires the presence of a default user value to fulfill the contact
         ownership field in the environment variable `SF_DEFAULT_USER`.
+
+        Accounts are yielded as each batch of records arrives. Their number may
+        be capped with `limit`, or in the environment variable `SF_ACCOUNT_LIMIT`.
+
+        :param since: An optional `str` Salesforce datetime. If given, only the
+                      accounts modified at or after it are returned.
+        :param limit: An optional `int` maximum number of accounts.
         """
-        sql = """
+        if limit is None:
+            limit: int = int(os.getenv("SF_ACCOUNT_LIMIT", 0))
+
+        watermark: str = (
+            f"AND SystemModstamp >= {_soql_datetime(since)}" if since else ""
+        )
+        sql = f"""
             SELECT
                 Id, DSCORGPKG__DiscoverOrg_ID__c, Name, Phone, Website,
-                Enrichment_Requested_By__c, Enrichment_Requested_Date__c
+                Enrichment_Requested_By__c, Enrichment_Requested_Date__c,
+                SystemModstamp
             FROM
                 Account
             WHERE
                 Enrichment_Requested__c = True
             AND
                 Enrichment_Complete__c = False
+            {watermark}
+            {f"LIMIT {limit}" if limit else ""}
         """
-        records: list = self.api.query_all(sql)["records"]
-
-        count = 0
-        while records and count <= 100:
-            record: dict = records.pop(0)
-
+        for record in self._query(sql):
             yield Account(
                 salesforce_id=record.get("Id", ""),
                 discoverorg_id=record.get("DSCORGPKG__DiscoverOrg_ID__c", ""),
@@ -67,30 +176,67 @@ class SalesforceClient:
                 name=record.get("Name", ""),
                 domain=record.get("Website", ""),
                 phone=record.get("Phone", ""),
+                modified=record.get("SystemModstamp", ""),
+                requested=record.get("Enrichment_Requested_Date__c") or "",
             )
 
-            count += 1
+    @METRICS.timed("sf.prefetch_contacts")
+    def prefetch_contacts(self, accounts: Iterable[Account]) -> None:
+        """Load the existing contacts of many accounts with batched queries.
+
+        The accounts' IDs are queried in chunks of `AccountId IN (...)` clauses,
+        and the records are indexed by account ID for `get_contacts`. The chunk
+        size may be set in the environment variable `SF_PREFETCH_CHUNK`.
+
+        :param accounts: An iterable of `Account` objects.
+        """
+        ids: list = [account.salesforce_id for account in accounts]
+        index: dict = {i: [] for i in ids}
+        size: int = int(os.getenv("SF_PREFETCH_CHUNK", 200))
+
+        for start in range(0, len(ids), size):
+            chunk: str = ", ".join(f"'{i}'" for i in ids[start : start + size])
+            sql: str = f"""
+                SELECT
+                    Id, AccountId, Name, Title,
+                    Phone, MobilePhone, Email,
+                    Contact_Status__c
+                FROM
+                    Contact
+                WHERE
+                    AccountId IN ({chunk})
+            """
+            for record in self._query(sql):
+                index.setdefault(record.get("AccountId"), []).append(record)
+
+        with self._contacts_lock:
+            self._contacts.update(index)
 
     def get_contacts(self, account: Account) -> Generator[Contact, None, None]:
         """Yield a generator of contacts for a given account.
 
+        Accounts loaded by `prefetch_contacts` are served from memory, and their
+        records are released once read. Any other account is queried directly.
+
         :param account: An `Account` object.
         """
-        sql: str = f"""
-            SELECT
-                Id, Name, Title,
-                Phone, MobilePhone, Email,
-                Contact_Status__c
-            FROM
-                Contact
-            WHERE
-                AccountId = '{account.salesforce_id}'
-        """
-        records: list = self.api.query_all(sql)["records"]
+        with self._contacts_lock:
+            records: list = self._contacts.pop(account.salesforce_id, None)
 
-        while records:
-            record: dict = records.pop(0)
+        if records is None:
+            sql: str = f"""
+                SELECT
+                    Id, Name, Title,
+                    Phone, MobilePhone, Email,
+                    Contact_Status__c
+                FROM
+                    Contact
+                WHERE
+                    AccountId = '{account.salesforce_id}'
+            """
+            records: Iterator[dict] = self._query(sql, "sf.get_contacts")
 
+        for record in records:
             yield Contact(
                 account=account.salesforce_id,
                 salesforce_id=record.get("Id", ""),
@@ -105,20 +251,78 @@ class SalesforceClient:
                 status="old",
             )
 
-    def upload_contacts(self, data: list):
+    def _query(self, sql: str, stage: str = None) -> Generator[dict, None, None]:
+        """Yield the records of a query as each batch of them arrives.
+
+        Only one batch is held in memory at a time, since later batches are
+        requested with the query's cursor as earlier ones are used up.
+
+        :param sql: A `str` SOQL query.
+        :param stage: An optional `str` name under which the time spent waiting
+                      on the API is recorded.
+        """
+        METRICS.count("requests", client="salesforce")
+        api: "ss.Salesforce" = self.api
+        records: Iterator[dict] = iter(api.query_all_iter(sql))
+
+        waited: float = 0.0
+        yielded: bool = False
+        renewed: bool = False
+        try:
+            while True:
+                start: float = time.perf_counter()
+                try:
+                    record: dict = next(records, None)
+                except _expired_session():
+                    if yielded or renewed:
+                        raise
+                    api, renewed = self._renew(api), True
+                    records = iter(api.query_all_iter(sql))
+                    continue
+                finally:
+                    waited += time.perf_counter() - start
+
+                if record is None:
+                    return
+
+                yielded = True
+                yield record
+        finally:
+            if stage:
+                METRICS.observe(stage, waited)
+
+    @METRICS.timed("sf.upload_contacts")
+    def upload_contacts(self, data: list) -> list:
         """Write all new contacts to Salesforce.
 
         :param: A `list` of formatted contact data `dict` objects.
+        :return: A `list` of the contact rows left unprocessed, which weren't
+                 written and may be written again.
         """
-        try:
-            self.api.bulk.Contact.insert(data)
-        except ss.SalesforceError as e:
-            error(f"Contact write failure. {e.message}")
+        result: BulkResult = self.bulk.insert("Contact", data)
+        _log_failures("Contact", result, "Email")
+
+        return _unprocessed(result)
+
+    @METRICS.timed("sf.upload_contacts")
+    def upload_contacts_csv(self, path: str) -> list:
+        """Write all new contacts in a CSV file to Salesforce.
+
+        :param path: The `str` path of a CSV file of formatted contact data.
+        :return: A `list` of the contact rows left unprocessed, which weren't
+                 written and may be written again.
+        """
+        result: BulkResult = self.bulk.insert_csv("Contact", path)
+        _log_failures("Contact", result, "Email")
 
-    def complete_enrichment(self, accounts: list) -> None:
+        return _unprocessed(result)
+
+    @METRICS.timed("sf.complete_enrichment")
+    def complete_enrichment(self, accounts: list) -> list:
         """Write `Notes__c` and  `Enrichment_Complete__c` on given accounts.
 
         :param account: A `list` of `Account` objects.
+        :return: A `list` of the `Account` objects that were written.
         """
         data = []
         for account in accounts:
@@ -130,7 +334,56 @@ class SalesforceClient:
                 }
             )
 
-        try:
-            self.api.bulk.Account.update(data)
-        except ss.SalesforceError as e:
-            error(f"Account write failure. {e.message}")
+        result: BulkResult = self.bulk.update("Account", data)
+        _log_failures("Account", result, "Id")
+
+        failed: set = {row.get("Id") for row in result.failed}
+
+        return [a for a in accounts if str(a.salesforce_id) not in failed]
+
+
+def _expired_session() -> type:
+    """Get the exception raised for an expired session, importing it on use."""
+    from simple_salesforce.exceptions import SalesforceExpiredSession
+
+    return SalesforceExpiredSession
+
+
+def _soql_datetime(value: str) -> str:
+    """Format a datetime returned by the API as a SOQL literal.
+
+    The API returns offsets such as `+0000`, but SOQL requires `+00:00`.
+
+    :param value: A `str` Salesforce datetime.
+    :return: A `str` SOQL datetime literal.
+    """
+    match = re.match(r"^(.*[+-]\d\d)(\d\d)$", value)
+
+    return f"{match.group(1)}:{match.group(2)}" if match else value
+
+
+def _unprocessed(result: BulkResult) -> list:
+    """Get the rows of a bulk write that were never processed.
+
+    :param result: The `BulkResult` of the write.
+    :return: A `list` of field `dict` objects, without their result fields.
+    """
+    return [
+        {k: v for k, v in row.items() if not k.startswith("sf__")}
+        for row in result.failed
+        if row.get("sf__Error", "").startswith("UNPROCESSED")
+    ]
+
+
+def _log_failures(sobject: str, result: BulkResult, key: str) -> None:
+    """Log the rows of a bulk write that failed.
+
+    :param sobject: The `str` sObject name written.
+    :param result: The `BulkResult` of the write.
+    :param key: The `str` field that identifies a row in the log.
+    """
+    for row in result.failed[:10]:
+        error(f"{sobject} write failure for {row.get(key)}. {row.get('sf__Error')}")
+
+    if len(result.failed) > 10:
+        error(f"{len(result.failed) - 10} more {sobject} rows failed to write.")
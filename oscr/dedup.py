@@ -0,0 +1,134 @@
+"""
+oscr.dedup
+~~~~~~~~~~
+
+This module implements the index used to drop already-known contacts.
+"""
+
+import re
+from typing import Iterable
+
+from oscr.models import Account, Contact
+
+_HOST = re.compile(r"^(?:https?://)?(?:[^@/\n]+@)?(?:www\.)?([^:/?\n]+)")
+_WHITESPACE = re.compile(r"\s+")
+
+_SECOND_LEVEL = {"ac", "co", "com", "edu", "gov", "ltd", "net", "org", "plc"}
+
+
+class DedupIndex:
+    """Implement the `DedupIndex` class.
+
+    This class indexes the names, emails, and domains of the contacts an account
+    already has, so each candidate contact is checked with a few set lookups.
+    Keys are normalized: names have their whitespace collapsed and are
+    case-folded, emails are case-folded, and domains are reduced to their
+    registrable domain.
+
+    Every key is scoped to its account's Salesforce ID, so one index may serve a
+    single account or be built once across a whole run.
+    """
+
+    def __init__(self):
+        self._names: set = set()
+        self._emails: set = set()
+        self._domains: set = set()
+
+    def add_account(self, account: Account) -> None:
+        """Index the domain of an account's website.
+
+        :param account: An `Account` object.
+        """
+        hosts: list = _HOST.findall((account.domain or "").strip().lower())
+
+        if hosts:
+            self._domains.add((account.salesforce_id, registrable_domain(hosts[0])))
+
+    def add_contacts(self, contacts: Iterable[Contact]) -> None:
+        """Index an account's existing contacts.
+
+        :param contacts: An iterable of `Contact` objects.
+        """
+        for contact in contacts:
+            scope: str = contact.account
+
+            self._names.add((scope, normalize_name(contact.name)))
+
+            if contact.email:
+                self._emails.add((scope, normalize_email(contact.email)))
+
+                if "@" in contact.email:
+                    self._domains.add((scope, email_domain(contact.email)))
+
+    def is_new(self, contact: Contact) -> bool:
+        """Check whether a contact is new to its account.
+
+        A new contact has an email on one of the account's domains, and shares
+        neither its name nor its email with an existing contact.
+
+        :param contact: A `Contact` object.
+        :return: `True` if the contact is new.
+        """
+        if not contact.email or "@" not in contact.email:
+            return False
+
+        scope: str = contact.account
+
+        return (
+            (scope, normalize_name(contact.name)) not in self._names
+            and (scope, normalize_email(contact.email)) not in self._emails
+            and (scope, email_domain(contact.email)) in self._domains
+        )
+
+    def filter(self, contacts: Iterable[Contact]) -> list:
+        """Keep only the contacts that are new to their accounts.
+
+        :param contacts: An iterable of `Contact` objects.
+        :return: A `list` of new `Contact` objects, in their original order.
+        """
+        return [contact for contact in contacts if self.is_new(contact)]
+
+
+def normalize_name(name: str) -> str:
+    """Collapse a name's whitespace and case-fold it.
+
+    :param name: A `str` name.
+    :return: A normalized `str` name.
+    """
+    return _WHITESPACE.sub(" ", (name or "").strip()).casefold()
+
+
+def normalize_email(email: str) -> str:
+    """Case-fold an email address.
+
+    :param email: A `str` email address.
+    :return: A normalized `str` email address.
+    """
+    return email.strip().casefold()
+
+
+def email_domain(email: str) -> str:
+    """Get the registrable domain of an email address.
+
+    :param email: A `str` email address.
+    :return: A `str` registrable domain.
+    """
+    return registrable_domain(email.rpartition("@")[2])
+
+
+def registrable_domain(host: str) -> str:
+    """Reduce a host name to its registrable domain.
+
+    This is the last two labels of the host, or the last three where the
+    second-to-last is a common second-level label under a country code, as in
+    `example.co.uk`.
+
+    :param host: A `str` host name.
+    :return: A `str` registrable domain.
+    """
+    labels: list = host.strip().strip(".").casefold().split(".")
+
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL:
+        return ".".join(labels[-3:])
+
+    return ".".join(labels[-2:])
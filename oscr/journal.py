@@ -0,0 +1,252 @@
+"""
+oscr.journal
+~~~~~~~~~~~~
+
+This module implements the crash-safe journal of enrichment runs.
+"""
+
+import dataclasses
+import json
+import os
+import threading
+from logging import info, warning
+from typing import Iterable
+
+from oscr.models import Account
+
+
+class Journal:
+    """Implement the `Journal` class.
+
+    This class appends every finished account's enrichment result, and the
+    upload state of every batch written to Salesforce, to a local JSON lines
+    file. Each entry is flushed to disk before the run moves on, so a run that
+    dies partway through loses none of the DiscoverOrg work it already paid for.
+
+    On the next run, accounts with a journaled result are not enriched again;
+    instead, only the writes that hadn't completed are replayed. Accounts that
+    aren't pending in a run stay journaled until a full scan shows they were
+    completed. Once every journaled account has been completed, the journal is
+    removed.
+
+    Its path may be set in the environment variable `OSCR_JOURNAL`. Setting it to
+    an empty value disables journaling.
+    """
+
+    def __init__(self, path: str = None):
+        self.path: str = path if path is not None else default_path()
+
+        self._lock: threading.Lock = threading.Lock()
+        self._results: dict = {}
+        self._uploaded: set = set()
+        self._open: set = set()
+
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._load()
+
+    def _load(self) -> None:
+        """Read the results and upload states left by earlier runs."""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as f:
+            self._read(f)
+
+        if self._results:
+            info(f"Journal holds {len(self._results)} unfinished accounts.")
+
+    def _read(self, lines: Iterable[str]) -> None:
+        """Apply journal entries to the results and upload states.
+
+        :param lines: An iterable of `str` JSON lines.
+        """
+        for line in lines:
+            try:
+                entry: dict = json.loads(line)
+            except ValueError:
+                warning("Skipping a torn journal entry.")
+                continue
+
+            if entry["event"] == "enriched":
+                account_id: str = entry["account"]["salesforce_id"]
+                self._results[account_id] = entry
+                self._open.add(account_id)
+                self._uploaded.discard(account_id)
+            elif entry["event"] == "contacts_uploaded":
+                self._uploaded.update(entry["accounts"])
+            elif entry["event"] == "accounts_completed":
+                for account_id in entry["accounts"]:
+                    self._results.pop(account_id, None)
+                    self._open.discard(account_id)
+
+    def adopt(self, path: str) -> None:
+        """Take over the journal of a process that died.
+
+        Its entries are appended to this journal, and its file is removed. The
+        file is first renamed to a unique name, which only one process can do,
+        so that no two processes adopt the same journal.
+
+        :param path: The `str` path of the other journal.
+        """
+        if not self.path:
+            return
+
+        adopted: str = f"{path}.{os.getpid()}.adopted"
+        try:
+            os.rename(path, adopted)
+        except FileNotFoundError:
+            return
+
+        with open(adopted) as f:
+            lines: list = f.readlines()
+
+        with self._lock:
+            self._read(lines)
+            with open(self.path, "a") as f:
+                f.writelines(line if line.endswith("\n") else "" for line in lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.remove(adopted)
+        info(f"Adopted {len(lines)} entries from {os.path.basename(path)}.")
+
+    def _append(self, entry: dict) -> None:
+        """Durably append an entry to the journal.
+
+        :param entry: A JSON-friendly `dict`.
+        """
+        if not self.path:
+            return
+
+        line: str = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def replay(
+        self, accounts: Iterable[Account], scanned: Iterable[Account] = None
+    ) -> list:
+        """Get the unfinished writes of journaled accounts that are still pending.
+
+        The accounts returned needn't be enriched again. Journaled accounts that
+        aren't among `accounts` are kept for a later replay, unless a full scan
+        shows they are no longer pending in Salesforce, so were completed after
+        all, in which case they are forgotten.
+
+        :param accounts: An iterable of the pending `Account` objects to replay.
+        :param scanned: An optional iterable of every pending `Account` object,
+                        given only if it comes from a full, unlimited scan.
+        :return: A `list` of `tuple` pairs of an `Account` and its formatted
+                 contact data `dict` objects still to be uploaded.
+        """
+        wanted: set = {account.salesforce_id for account in accounts}
+        pending: set = (
+            None if scanned is None else {account.salesforce_id for account in scanned}
+        )
+
+        with self._lock:
+            replay: list = []
+            for account_id, entry in list(self._results.items()):
+                if account_id in wanted:
+                    del self._results[account_id]
+                    account: Account = Account(**entry["account"])
+                    uploaded: bool = account_id in self._uploaded
+                    replay.append((account, [] if uploaded else entry["contacts"]))
+                elif pending is not None and account_id not in pending:
+                    del self._results[account_id]
+                    self._open.discard(account_id)
+
+        return replay
+
+    def is_open(self, account_id: str) -> bool:
+        """Check whether an account was enriched but hasn't been completed yet.
+
+        :param account_id: A `str` Salesforce account ID.
+        :return: `True` if the account is still being written.
+        """
+        with self._lock:
+            return account_id in self._open
+
+    def record_enriched(self, account: Account, contacts: list) -> None:
+        """Journal an account's enrichment result.
+
+        :param account: An `Account` object with its `notes` set.
+        :param contacts: A `list` of formatted contact data `dict` objects.
+        """
+        with self._lock:
+            self._open.add(account.salesforce_id)
+
+        self._append(
+            {
+                "event": "enriched",
+                "account": dataclasses.asdict(account),
+                "contacts": contacts,
+            }
+        )
+
+    def record_unfinished(self, account: Account, contacts: list) -> None:
+        """Journal the contacts of an account that are still to be uploaded.
+
+        They replace its earlier result, and are returned by the next `replay`.
+
+        :param account: An `Account` object with its `notes` set.
+        :param contacts: A `list` of formatted contact data `dict` objects.
+        """
+        entry: dict = {
+            "event": "enriched",
+            "account": dataclasses.asdict(account),
+            "contacts": contacts,
+        }
+        with self._lock:
+            self._open.add(account.salesforce_id)
+            self._results[account.salesforce_id] = entry
+            self._uploaded.discard(account.salesforce_id)
+
+        self._append(entry)
+
+    def record_contacts_uploaded(self, accounts: list) -> None:
+        """Journal that the contacts of a batch of accounts were uploaded.
+
+        :param accounts: A `list` of `Account` objects.
+        """
+        self._append(
+            {
+                "event": "contacts_uploaded",
+                "accounts": [account.salesforce_id for account in accounts],
+            }
+        )
+
+    def record_accounts_completed(self, accounts: list) -> None:
+        """Journal that a batch of accounts was marked complete.
+
+        :param accounts: A `list` of `Account` objects.
+        """
+        ids: list = [account.salesforce_id for account in accounts]
+        self._append({"event": "accounts_completed", "accounts": ids})
+
+        with self._lock:
+            self._open.difference_update(ids)
+
+    def compact(self) -> None:
+        """Remove the journal if every account in it has been completed."""
+        with self._lock:
+            if self.path and not self._open and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def close(self) -> None:
+        """Compact the journal at the end of a run."""
+        self.compact()
+
+
+def default_path() -> str:
+    """Get the configured journal path.
+
+    :return: The `str` path, which is empty if journaling is disabled.
+    """
+    return os.getenv(
+        "OSCR_JOURNAL",
+        os.path.join(os.path.expanduser("~"), ".oscr", "journal.jsonl"),
+    )
@@ -0,0 +1,260 @@
+"""
+oscr.metrics
+~~~~~~~~~~~~
+
+This module implements run metrics and their export.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from logging import info
+from statistics import quantiles
+from typing import Callable
+
+from oscr.profiling import PROFILER
+
+
+class Metrics:
+    """Implement the `Metrics` class.
+
+    This class times the stages of a run and counts the events of each API
+    client, such as requests, bytes, retries, and seconds spent waiting on rate
+    limits. Every measurement is also attributed to the account being enriched
+    by the current thread, if any.
+
+    When a run finishes, `export` writes a JSON summary to the file named in the
+    environment variable `OSCR_METRICS_JSON`, and a Prometheus textfile to the
+    one named in `OSCR_METRICS_PROM`, if they are set.
+    """
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self._local: threading.local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """Discard every measurement."""
+        with self._lock:
+            self.stages: dict = defaultdict(list)
+            self.totals: dict = defaultdict(lambda: [0, 0.0])
+            self.counters: Counter = Counter()
+            self.accounts: dict = defaultdict(Counter)
+
+    def roll(self) -> None:
+        """Start a new window of stage samples and per-account measurements.
+
+        The counters, and each stage's count and total duration, keep running,
+        so that a long-lived process exports them as monotonic totals while its
+        memory stays bounded by the window.
+        """
+        with self._lock:
+            self.stages = defaultdict(list)
+            self.accounts = defaultdict(Counter)
+
+    @property
+    def current(self) -> str:
+        """Get the ID of the account the current thread is working on."""
+        return getattr(self._local, "account", None)
+
+    @contextmanager
+    def account(self, account_id: str):
+        """Attribute measurements made in this block to an account.
+
+        :param account_id: A `str` Salesforce account ID.
+        """
+        previous: str = self.current
+        self._local.account = account_id
+        try:
+            yield
+        finally:
+            self._local.account = previous
+
+    def bound(self, fn: Callable) -> Callable:
+        """Bind a callable to the current account, for running on another thread.
+
+        :param fn: A callable.
+        :return: A callable that runs `fn` attributed to the current account.
+        """
+        account_id: str = self.current
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.account(account_id):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time a block as one sample of a stage.
+
+        While profiling, the block's allocations are also added to the stage.
+
+        :param stage: A `str` stage name.
+        """
+        start: float = time.perf_counter()
+        try:
+            with PROFILER.stage(stage):
+                yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str) -> Callable:
+        """Decorate a function so that each call is timed as a stage.
+
+        :param stage: A `str` stage name.
+        """
+
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record one sample of a stage.
+
+        :param stage: A `str` stage name.
+        :param seconds: The `float` duration of the sample.
+        """
+        account_id: str = self.current
+        with self._lock:
+            self.stages[stage].append(seconds)
+            totals: list = self.totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+            if account_id:
+                self.accounts[account_id][f"{stage}_seconds"] += seconds
+
+    def count(self, name: str, value: float = 1, client: str = "oscr") -> None:
+        """Add to a counter.
+
+        :param name: A `str` counter name.
+        :param value: The `float` amount to add.
+        :param client: The `str` name of the client the event belongs to.
+        """
+        account_id: str = self.current
+        with self._lock:
+            self.counters[(name, client)] += value
+            if account_id:
+                self.accounts[account_id][f"{client}_{name}"] += value
+
+    def summary(self) -> dict:
+        """Summarize every measurement.
+
+        :return: A JSON-friendly `dict`.
+        """
+        with self._lock:
+            stages: dict = {k: list(v) for k, v in self.stages.items()}
+            totals: dict = {k: tuple(v) for k, v in self.totals.items()}
+            counters: Counter = Counter(self.counters)
+            accounts: dict = {k: dict(v) for k, v in self.accounts.items()}
+
+        summary: dict = {"stages": {}, "counters": {}, "accounts": accounts}
+        for stage, (count, total) in sorted(totals.items()):
+            summary["stages"][stage] = {"count": count, "sum": round(total, 6)}
+
+            samples: list = stages.get(stage)
+            if not samples:
+                continue
+            elif len(samples) > 1:
+                cuts: list = quantiles(samples, n=100, method="inclusive")
+                p50, p95 = cuts[49], cuts[94]
+            else:
+                p50 = p95 = samples[0]
+
+            summary["stages"][stage].update(
+                p50=round(p50, 6), p95=round(p95, 6), max=round(max(samples), 6)
+            )
+
+        for (name, client), value in sorted(counters.items()):
+            summary["counters"].setdefault(client, {})[name] = round(value, 6)
+
+        return summary
+
+    def prometheus(self, summary: dict = None) -> str:
+        """Render the run's metrics in the Prometheus text format.
+
+        Per-account measurements are left out, to keep label cardinality low.
+
+        :param summary: An optional `dict` produced by `summary`.
+        :return: A `str` Prometheus textfile.
+        """
+        summary: dict = summary or self.summary()
+        lines: list = [
+            "# HELP oscr_stage_seconds Duration of each OSCR stage.",
+            "# TYPE oscr_stage_seconds summary",
+        ]
+        for stage, stats in summary["stages"].items():
+            label: str = f'stage="{stage}"'
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+                if key not in stats:
+                    continue
+                lines.append(
+                    f'oscr_stage_seconds{{{label},quantile="{quantile}"}} {stats[key]}'
+                )
+            lines.append(f"oscr_stage_seconds_sum{{{label}}} {stats['sum']}")
+            lines.append(f"oscr_stage_seconds_count{{{label}}} {stats['count']}")
+
+        names: set = {name for c in summary["counters"].values() for name in c}
+        for name in sorted(names):
+            lines.append(f"# TYPE oscr_{name}_total counter")
+            for client, counters in summary["counters"].items():
+                if name in counters:
+                    lines.append(
+                        f'oscr_{name}_total{{client="{client}"}} {counters[name]}'
+                    )
+
+        lines.append("# TYPE oscr_last_run_timestamp_seconds gauge")
+        lines.append(f"oscr_last_run_timestamp_seconds {time.time():.0f}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> dict:
+        """Write the run's metrics to the configured files and log a summary.
+
+        :return: The `dict` summary.
+        """
+        summary: dict = self.summary()
+
+        path: str = os.getenv("OSCR_METRICS_JSON")
+        if path:
+            _write_atomic(path, json.dumps(summary, indent=2))
+
+        path: str = os.getenv("OSCR_METRICS_PROM")
+        if path:
+            _write_atomic(path, self.prometheus(summary))
+
+        for stage, stats in summary["stages"].items():
+            if "p95" in stats:
+                info(
+                    f"{stage}: {stats['count']} calls, {stats['sum']:.2f}s total, "
+                    f"p95 {stats['p95']:.3f}s."
+                )
+
+        return summary
+
+
+def _write_atomic(path: str, text: str) -> None:
+    """Write a file so that readers never see it half-written.
+
+    :param path: The `str` path of the file.
+    :param text: The `str` contents of the file.
+    """
+    temp: str = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as f:
+        f.write(text)
+
+    os.replace(temp, path)
+
+
+METRICS: Metrics = Metrics()
@@ -5,9 +5,45 @@ oscr.models
 This module implements data models.
 """
 
-from dataclasses import dataclass
+import sys
+from array import array
+from dataclasses import dataclass, fields
+from typing import Iterable, Iterator
 
 
+def _slotted(cls: type) -> type:
+    """Rebuild a dataclass with `__slots__` in place of a per-instance `__dict__`.
+
+    Field defaults are already bound into the generated `__init__`, so they are
+    dropped from the class body, where they would clash with the slots.
+
+    :param cls: A dataclass.
+    :return: An equivalent slotted dataclass.
+    """
+    names: tuple = tuple(f.name for f in fields(cls))
+
+    body: dict = dict(cls.__dict__)
+    body["__slots__"] = names
+    for name in names:
+        body.pop(name, None)
+    body.pop("__dict__", None)
+    body.pop("__weakref__", None)
+
+    slotted: type = type(cls)(cls.__name__, cls.__bases__, body)
+    slotted.__qualname__ = cls.__qualname__
+
+    return slotted
+
+
+def _intern(value):
+    """Intern a string, so that repeated values share one object.
+
+    :param value: A `str`, or any other value, which is returned as is.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+@_slotted
 @dataclass
 class Account:
     """ Model an `Account` object that parallels some Salesforce fields. """
@@ -19,7 +55,15 @@ class Account:
     domain: str
     phone: str
 
+    notes: str = ""
+    modified: str = ""
+    requested: str = ""
+
+    def __post_init__(self):
+        self.prep = _intern(self.prep)
+
 
+@_slotted
 @dataclass
 class Contact:
     """ Model a `Contact` object that parallels some Salesforce fields. """
@@ -39,3 +83,49 @@ class Contact:
     priority: int
 
     status: str
+
+    def __post_init__(self):
+        self.account = _intern(self.account)
+        self.office = _intern(self.office)
+        self.status = _intern(self.status)
+
+
+class ContactBatch:
+    """Model a batch of `Contact` objects with columnar ratings and priorities.
+
+    The ratings and priorities are held in compact arrays that scoring and
+    selection work on directly, so the contacts a batch drops are never touched
+    after they are scored. Only the contacts kept by `take` have their fields
+    brought up to date with the columns.
+    """
+
+    __slots__ = ("contacts", "ratings", "priorities")
+
+    def __init__(self, contacts: Iterable[Contact] = ()):
+        self.contacts: list = list(contacts)
+        self.ratings: array = array("h", [c.rating for c in self.contacts])
+        self.priorities: array = array("h", [c.priority for c in self.contacts])
+
+    def __len__(self) -> int:
+        return len(self.contacts)
+
+    def __iter__(self) -> Iterator[Contact]:
+        return iter(self.contacts)
+
+    def take(self, indices: Iterable[int]) -> "ContactBatch":
+        """Get a new batch of the contacts at some positions, in order.
+
+        :param indices: An iterable of `int` positions.
+        :return: A `ContactBatch`.
+        """
+        batch: ContactBatch = ContactBatch()
+        for i in indices:
+            contact: Contact = self.contacts[i]
+            contact.rating = self.ratings[i]
+            contact.priority = self.priorities[i]
+
+            batch.contacts.append(contact)
+            batch.ratings.append(contact.rating)
+            batch.priorities.append(contact.priority)
+
+        return batch
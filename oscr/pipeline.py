@@ -0,0 +1,212 @@
+"""
+oscr.pipeline
+~~~~~~~~~~~~~
+
+This module implements the streaming upload stage of the enrichment process.
+"""
+
+import csv
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import error, info
+
+from oscr.journal import Journal
+from oscr.models import Account
+from oscr.clients.salesforce import SalesforceClient
+
+
+class UploadPipeline:
+    """Implement the `UploadPipeline` class.
+
+    This class collects enriched accounts and their prepared contacts as they
+    finish, and writes them to Salesforce in batches on a background thread, so
+    uploads overlap with ongoing enrichment and memory stays bounded by the batch
+    size rather than by the whole run.
+
+    Batches are written in the order they were filled, and each batch's accounts
+    are only marked complete once its contacts have been uploaded. If a `Journal`
+    is given, the upload state of each batch is recorded in it. The number of
+    accounts per batch may be set in the environment variable `OSCR_BATCH_SIZE`.
+
+    If more contact rows than `OSCR_SPILL_ROWS` are waiting on the uploader, any
+    further batch's contacts are spilled to a CSV file in `OSCR_SPILL_DIR` and
+    uploaded from disk. The file is removed once the batch is written, since any
+    rows left over are journaled. Spilling is disabled by default.
+    """
+
+    def __init__(
+        self,
+        sfc: SalesforceClient,
+        journal: Journal = None,
+        batch_size: int = None,
+        spill_rows: int = None,
+    ):
+        self.sfc: SalesforceClient = sfc
+        self.journal: Journal = journal
+        self.batch_size: int = batch_size or int(os.getenv("OSCR_BATCH_SIZE", 10))
+        self.spill_rows: int = spill_rows or int(os.getenv("OSCR_SPILL_ROWS", 0))
+        self.spill_dir: str = os.getenv("OSCR_SPILL_DIR", tempfile.gettempdir())
+
+        self._contacts: list = []
+        self._accounts: list = []
+
+        self._queued_rows: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._futures: list = []
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+
+    def add(self, account: Account, contacts: list) -> None:
+        """Add an enriched account and its prepared contacts.
+
+        :param account: An `Account` object with its `notes` set.
+        :param contacts: A `list` of formatted contact data `dict` objects.
+        """
+        self._contacts.extend(contacts)
+        self._accounts.append(account)
+
+        if len(self._accounts) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the current batch off to the uploader thread."""
+        contacts, self._contacts = self._contacts, []
+        accounts, self._accounts = self._accounts, []
+
+        if not contacts and not accounts:
+            return
+
+        if contacts and self.spill_rows and self._queued_rows >= self.spill_rows:
+            contacts: str = self._spill(contacts)
+            rows: int = 0
+        else:
+            rows: int = len(contacts)
+
+        with self._lock:
+            self._queued_rows += rows
+
+        future: Future = self._executor.submit(self._upload, contacts, accounts, rows)
+        self._futures.append(future)
+
+    def close(self) -> None:
+        """Flush the last batch and wait for every upload to finish."""
+        self.flush()
+
+        for future in self._futures:
+            future.result()
+
+        self._executor.shutdown()
+
+    def _upload(self, contacts, accounts: list, rows: int) -> None:
+        """Write one batch to Salesforce.
+
+        Accounts that aren't completed, whether their write failed or the batch
+        raised, are journaled again with any contacts not yet uploaded, so that
+        the next replay finishes them.
+
+        :param contacts: A `list` of formatted contact data `dict` objects, or the
+                         `str` path of a CSV file they were spilled to.
+        :param accounts: A `list` of `Account` objects.
+        :param rows: The `int` number of contact rows held in memory.
+        """
+        uploaded: bool = False
+        try:
+            if isinstance(contacts, str):
+                info(f"Uploading contacts from {contacts}.")
+                left: list = self.sfc.upload_contacts_csv(contacts)
+            elif contacts:
+                info(f"Uploading {len(contacts)} contacts.")
+                left: list = self.sfc.upload_contacts(contacts)
+            else:
+                left: list = []
+            uploaded = True
+
+            if left:
+                accounts = self._hold(accounts, left)
+                if not accounts:
+                    return
+
+            if contacts:
+                info("Upload complete.")
+                if self.journal:
+                    self.journal.record_contacts_uploaded(accounts)
+
+            if accounts:
+                info(f"Completing enrichment on {len(accounts)} accounts.")
+                completed: list = self.sfc.complete_enrichment(accounts)
+                info(f"Enrichment complete on {len(completed)} accounts.")
+                if self.journal and completed:
+                    self.journal.record_accounts_completed(completed)
+
+                failed: list = [a for a in accounts if a not in completed]
+                if failed:
+                    error(f"Leaving {len(failed)} accounts incomplete.")
+                    self._reopen(failed, [])
+        except Exception as e:
+            error(f"Batch write failure. {e}")
+            self._reopen(accounts, [] if uploaded else contacts)
+        finally:
+            if isinstance(contacts, str):
+                os.remove(contacts)
+
+            with self._lock:
+                self._queued_rows -= rows
+
+    def _hold(self, accounts: list, left: list) -> list:
+        """Leave the accounts with unprocessed contacts incomplete.
+
+        If a `Journal` is kept, only their unprocessed contacts are journaled
+        again, so that they, and no others, are replayed.
+
+        :param accounts: A `list` of `Account` objects.
+        :param left: A `list` of the unprocessed contact data `dict` objects.
+        :return: A `list` of the other `Account` objects.
+        """
+        held: set = {row.get("AccountId") for row in left}
+        error(
+            f"{len(left)} contacts weren't uploaded. "
+            f"Leaving {len(held)} accounts incomplete."
+        )
+        self._reopen([a for a in accounts if a.salesforce_id in held], left)
+
+        return [a for a in accounts if a.salesforce_id not in held]
+
+    def _reopen(self, accounts: list, contacts) -> None:
+        """Journal accounts that weren't completed with their contacts to upload.
+
+        :param accounts: A `list` of `Account` objects.
+        :param contacts: A `list` of formatted contact data `dict` objects still
+                         to be uploaded, or the `str` path of a CSV file of them.
+        """
+        if not self.journal:
+            return
+
+        if isinstance(contacts, str):
+            with open(contacts, newline="") as f:
+                contacts: list = list(csv.DictReader(f))
+
+        rows: dict = defaultdict(list)
+        for row in contacts:
+            rows[row.get("AccountId")].append(row)
+
+        for account in accounts:
+            self.journal.record_unfinished(account, rows[account.salesforce_id])
+
+    def _spill(self, contacts: list) -> str:
+        """Write contact rows to a CSV file for the bulk API.
+
+        :param contacts: A `list` of formatted contact data `dict` objects.
+        :return: The `str` path of the CSV file.
+        """
+        fd, path = tempfile.mkstemp(prefix="oscr-", suffix=".csv", dir=self.spill_dir)
+
+        with os.fdopen(fd, "w", newline="") as f:
+            writer: csv.DictWriter = csv.DictWriter(f, fieldnames=list(contacts[0]))
+            writer.writeheader()
+            writer.writerows(contacts)
+
+        info(f"Spilled {len(contacts)} contacts to {path}.")
+
+        return path
@@ -0,0 +1,295 @@
+"""
+oscr.profiling
+~~~~~~~~~~~~~~
+
+This module implements the profiling mode of OSCR runs.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from logging import info
+
+
+class Profiler:
+    """Implement the `Profiler` class.
+
+    This class finds where the time and memory of a run go. While it is started:
+
+    - Each account's enrichment runs under its own `cProfile` session, which is
+      saved on its own and merged into one `pstats` file for the run.
+    - A sampling thread records the stack of every thread at a fixed interval,
+      as collapsed stacks that flame graph tools read, for the whole run and
+      for each account. Samples of idle threads, such as pool workers waiting
+      for work, are left out.
+    - `tracemalloc` traces allocations, and the net bytes allocated during each
+      stage timed by `oscr.metrics` are added up. Stages that run concurrently
+      overlap, so run with one worker for exact figures per stage.
+
+    When it is stopped, the profiles and a report of the top hotspots are written
+    to its directory. `cProfile` slows the enrichment threads down, and only
+    profiles the thread that enriches an account, not the threads it fans API
+    calls out to, which the sampler still covers.
+
+    The sampling interval in seconds and the number of hotspots reported may be
+    set in the environment variables `OSCR_PROFILE_INTERVAL` and
+    `OSCR_PROFILE_TOP`. Until it is started, profiling costs nothing.
+    """
+
+    def __init__(self):
+        self.path: str = None
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        """Check whether the profiler has been started."""
+        return self.path is not None
+
+    def start(self, path: str, interval: float = None, top: int = None) -> None:
+        """Start profiling.
+
+        :param path: The `str` path of the directory to write the profiles to.
+        :param interval: An optional `float` number of seconds between samples.
+        :param top: An optional `int` number of hotspots to report.
+        """
+        self.interval: float = interval or float(
+            os.getenv("OSCR_PROFILE_INTERVAL", 0.01)
+        )
+        self.top: int = top or int(os.getenv("OSCR_PROFILE_TOP", 25))
+
+        os.makedirs(os.path.join(path, "accounts"), exist_ok=True)
+
+        self.stats: pstats.Stats = None
+        self.stacks: Counter = Counter()
+        self.account_stacks: dict = defaultdict(Counter)
+        self.allocations: dict = defaultdict(lambda: [0, 0])
+        self.idle: int = 0
+        self._accounts: dict = {}
+
+        self._traced: bool = not tracemalloc.is_tracing()
+        if self._traced:
+            tracemalloc.start()
+
+        self._stop.clear()
+        self._sampler: threading.Thread = threading.Thread(
+            target=self._sample, name="oscr-profiler", daemon=True
+        )
+        self.path = path
+        self._sampler.start()
+
+        info(f"Profiling to {path}.")
+
+    def stop(self) -> None:
+        """Stop profiling, and write the profiles and report."""
+        if not self.active:
+            return
+
+        self._stop.set()
+        self._sampler.join()
+
+        snapshot: tracemalloc.Snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            if self._traced:
+                tracemalloc.stop()
+
+        path: str = self.path
+        self.path = None
+
+        if self.stats is not None:
+            self.stats.dump_stats(os.path.join(path, "profile.pstats"))
+
+        _write_stacks(os.path.join(path, "stacks.collapsed"), self.stacks)
+        for account_id, stacks in self.account_stacks.items():
+            _write_stacks(
+                os.path.join(path, "accounts", f"{account_id}.collapsed"), stacks
+            )
+
+        with open(os.path.join(path, "allocations.json"), "w") as f:
+            json.dump(
+                {
+                    stage: {"calls": calls, "net_bytes": size}
+                    for stage, (calls, size) in sorted(self.allocations.items())
+                },
+                f,
+                indent=2,
+            )
+
+        report: str = self.report(snapshot)
+        with open(os.path.join(path, "report.txt"), "w") as f:
+            f.write(report)
+
+        info(f"Profile written to {path}.\n{report}")
+
+    @contextmanager
+    def account(self, account_id: str):
+        """Profile a block as the enrichment of an account.
+
+        :param account_id: A `str` Salesforce account ID.
+        """
+        if not self.active:
+            yield
+            return
+
+        thread: int = threading.get_ident()
+        profile: cProfile.Profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Interpreters that allow one active profiler at a time refuse
+            # concurrent sessions, so this account is only sampled.
+            profile = None
+
+        with self._lock:
+            self._accounts[thread] = account_id
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._accounts.pop(thread, None)
+
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(
+                    os.path.join(self.path, "accounts", f"{account_id}.pstats")
+                )
+                with self._lock:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile, stream=io.StringIO())
+                    else:
+                        self.stats.add(profile)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Add up the net bytes allocated during a block to a stage.
+
+        :param stage: A `str` stage name.
+        """
+        if not self.active:
+            yield
+            return
+
+        before: int = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            allocated: int = tracemalloc.get_traced_memory()[0] - before
+            with self._lock:
+                totals: list = self.allocations[stage]
+                totals[0] += 1
+                totals[1] += allocated
+
+    def _sample(self) -> None:
+        """Record the stacks of every other thread until stopped."""
+        own: int = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames: dict = sys._current_frames()
+            with self._lock:
+                for thread, frame in frames.items():
+                    if thread == own:
+                        continue
+                    if _idle(frame):
+                        self.idle += 1
+                        continue
+
+                    stack: list = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(
+                            f"{code.co_name} "
+                            f"({os.path.basename(code.co_filename)}:"
+                            f"{code.co_firstlineno})"
+                        )
+                        frame = frame.f_back
+
+                    collapsed: str = ";".join(reversed(stack))
+                    self.stacks[collapsed] += 1
+
+                    account_id: str = self._accounts.get(thread)
+                    if account_id:
+                        self.account_stacks[account_id][collapsed] += 1
+
+    def report(self, snapshot: tracemalloc.Snapshot = None) -> str:
+        """Report the top hotspots of a run.
+
+        :param snapshot: An optional `tracemalloc.Snapshot` taken at the end of
+                         the run.
+        :return: A `str` report.
+        """
+        lines: list = []
+
+        samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            samples[stack.rsplit(";", 1)[-1]] += count
+        total: int = sum(samples.values()) or 1
+
+        lines.append(
+            f"Top functions by sampled time ({total} busy samples, "
+            f"{self.idle} idle):"
+        )
+        for frame, count in samples.most_common(self.top):
+            lines.append(f"  {count / total:7.2%}  {frame}")
+
+        if self.stats is not None:
+            stream: io.StringIO = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats("tottime").print_stats(self.top)
+            lines.append("")
+            lines.append("Top functions by profiled time:")
+            lines.extend(
+                f"  {line}" for line in stream.getvalue().splitlines() if line.strip()
+            )
+
+        lines.append("")
+        lines.append("Net bytes allocated by stage:")
+        for stage, (calls, size) in sorted(
+            self.allocations.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(f"  {size:>14,}  {stage} ({calls} calls)")
+
+        if snapshot is None:
+            return "\n".join(lines) + "\n"
+
+        lines.append("")
+        lines.append("Top sites of memory still allocated:")
+        for stat in snapshot.statistics("lineno")[: self.top]:
+            frame: tracemalloc.Frame = stat.traceback[0]
+            lines.append(
+                f"  {stat.size:>14,}  {frame.filename}:{frame.lineno} "
+                f"({stat.count} blocks)"
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+def _idle(frame) -> bool:
+    """Check whether a thread is blocked in `threading` or waiting for pool work.
+
+    :param frame: The innermost frame of the thread.
+    """
+    code = frame.f_code
+    name: str = os.path.basename(code.co_filename)
+
+    return name == "threading.py" or (name == "thread.py" and code.co_name == "_worker")
+
+
+def _write_stacks(path: str, stacks: Counter) -> None:
+    """Write collapsed stacks, one `frame;frame;frame count` line per stack.
+
+    :param path: The `str` path of the file.
+    :param stacks: A `Counter` of samples by collapsed stack.
+    """
+    with open(path, "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+PROFILER: Profiler = Profiler()
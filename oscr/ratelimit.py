@@ -0,0 +1,170 @@
+"""
+oscr.ratelimit
+~~~~~~~~~~~~~~
+
+This module implements a proactive, host-wide rate limiter for API clients.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from logging import info
+from typing import Mapping
+
+
+class RateLimiter:
+    """Implement the `RateLimiter` class.
+
+    This class is a token bucket whose size and refill are learned from the
+    `X-Rate-Limit-Limit`, `X-Rate-Limit-Remaining`, and `X-Rate-Limit-Reset`
+    headers of the API's responses. The tokens left in the current window are
+    spread evenly over the time left before it resets, so requests are spaced to
+    stay under the quota instead of exhausting it and waiting out the window.
+
+    The bucket's state is kept in a small file guarded by an exclusive lock, so
+    one limiter is shared by every thread and every process on the host that
+    points at the same file. Its path may be set in the environment variable
+    `DO_RATE_LIMIT_FILE`.
+    """
+
+    def __init__(self, path: str = None):
+        self.path: str = path or os.getenv(
+            "DO_RATE_LIMIT_FILE",
+            os.path.join(tempfile.gettempdir(), "oscr-discoverorg.ratelimit"),
+        )
+        self._lock: threading.Lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Reserve a slot for one request and wait until it arrives.
+
+        :return: The `float` number of seconds spent waiting.
+        """
+        with self._locked() as state:
+            now: float = time.time()
+
+            if state.get("reset", 0) <= now:
+                state["remaining"] = state.get("limit")
+                state["reset"] = 0
+
+            remaining: int = state.get("remaining")
+            if remaining is None:
+                slot: float = now
+            elif remaining > 0:
+                interval: float = max(state["reset"] - now, 0) / remaining
+                slot: float = max(now, state.get("last", 0) + interval)
+                state["remaining"] = remaining - 1
+            else:
+                slot: float = max(state["reset"], state.get("last", 0))
+
+            state["last"] = slot
+
+        wait: float = max(slot - time.time(), 0)
+        if wait > 1:
+            info(f"Rate limit pacing. Waiting {wait:.1f} seconds.")
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    def update(
+        self, headers: Mapping, exhausted: bool = False, backoff: float = 0
+    ) -> None:
+        """Learn the current quota from a response's rate limit headers.
+
+        If the quota is spent but the response doesn't say when it resets, in
+        `X-Rate-Limit-Reset` or in a `Retry-After` number of seconds, it is
+        assumed to reset after `backoff` seconds.
+
+        :param headers: A `Mapping` of response headers.
+        :param exhausted: A `bool` marking the quota as spent, as on a 429.
+        :param backoff: A `float` number of seconds to wait if no reset is given.
+        """
+        limit: str = headers.get("X-Rate-Limit-Limit")
+        remaining: str = headers.get("X-Rate-Limit-Remaining")
+        reset: str = headers.get("X-Rate-Limit-Reset")
+
+        if reset is None and exhausted:
+            retry_after: str = headers.get("Retry-After", "").strip()
+            reset = retry_after if retry_after.isdigit() else str(backoff)
+
+        if reset is None:
+            return
+
+        with self._locked() as state:
+            reset_at: float = _reset_at(reset)
+
+            if limit is not None:
+                state["limit"] = int(limit)
+
+            if exhausted:
+                state["remaining"] = 0
+            elif remaining is not None:
+                remaining: int = int(remaining)
+                same_window: bool = abs(state.get("reset", 0) - reset_at) < 1
+                if same_window and state.get("remaining") is not None:
+                    remaining = min(remaining, state["remaining"])
+                state["remaining"] = remaining
+
+            state["reset"] = reset_at
+
+    def _locked(self):
+        """Open the shared state under both the thread and the file lock."""
+        return _LockedState(self.path, self._lock)
+
+
+class _LockedState:
+    """Context manager yielding the limiter's state `dict` while it is locked."""
+
+    def __init__(self, path: str, lock: threading.Lock):
+        self.path: str = path
+        self.lock: threading.Lock = lock
+
+    def __enter__(self) -> dict:
+        self.lock.acquire()
+        try:
+            self.fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+            raw: bytes = os.read(self.fd, 4096)
+            try:
+                self.state: dict = json.loads(raw) if raw else {}
+            except ValueError:
+                self.state: dict = {}
+        except BaseException:
+            self.lock.release()
+            raise
+
+        return self.state
+
+    def __exit__(self, *exc) -> None:
+        try:
+            data: bytes = json.dumps(self.state).encode()
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            os.ftruncate(self.fd, 0)
+            os.write(self.fd, data)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.lock.release()
+
+
+def _reset_at(value: str) -> float:
+    """Convert an `X-Rate-Limit-Reset` header value into an epoch timestamp.
+
+    The header has been observed both as an absolute epoch time and as a number
+    of seconds until the reset, so both are accepted.
+
+    :param value: A `str` header value.
+    :return: A `float` epoch timestamp.
+    """
+    reset: float = abs(float(value))
+
+    if reset > 1e12:
+        return reset / 1000
+    elif reset > 1e9:
+        return reset
+    else:
+        return time.time() + reset
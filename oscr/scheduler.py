@@ -0,0 +1,118 @@
+"""
+oscr.scheduler
+~~~~~~~~~~~~~~
+
+This module implements the ordering of pending accounts for enrichment.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+
+from oscr.models import Account
+
+
+class Scheduler:
+    """Implement the `Scheduler` class.
+
+    This class orders pending accounts so that reps see their accounts enriched
+    as soon as possible. Cheap accounts go first, so that one large enterprise
+    doesn't hold up many small ones, and every account gains priority as it
+    waits, so that large accounts are never starved. Only the order changes, so
+    the run's throughput is the same.
+
+    An account's score is its estimated cost, in person pages, less `aging`
+    pages for every hour since enrichment was requested. Accounts whose cost is
+    unknown are assumed to cost `default_cost` pages.
+
+    Requesters are served fairly: each is charged the cost of the accounts
+    scheduled for them, and `fairness` pages are added to a requester's next
+    account for each page they have been charged. At `0`, requesters are
+    ignored, and at `1`, every requester gets an equal share of the work.
+
+    The aging rate, fairness, and default cost may be set in the environment
+    variables `OSCR_AGING`, `OSCR_FAIRNESS`, and `OSCR_DEFAULT_COST`.
+    """
+
+    def __init__(
+        self, aging: float = None, fairness: float = None, default_cost: float = None
+    ):
+        self.aging: float = _setting(aging, "OSCR_AGING", 1.0)
+        self.fairness: float = _setting(fairness, "OSCR_FAIRNESS", 1.0)
+        self.default_cost: float = _setting(default_cost, "OSCR_DEFAULT_COST", 3.0)
+
+    def order(
+        self,
+        accounts: Iterable[Account],
+        cost: Callable[[Account], Optional[float]],
+        now: datetime = None,
+    ) -> list:
+        """Order accounts for enrichment.
+
+        :param accounts: An iterable of `Account` objects.
+        :param cost: A callable estimating the cost of an account, or returning
+                     `None` if it is unknown.
+        :param now: An optional aware `datetime` to measure waiting from.
+        :return: A `list` of the `Account` objects, in the order to enrich them.
+        """
+        now: datetime = now or datetime.now(timezone.utc)
+
+        queues: dict = defaultdict(list)
+        for position, account in enumerate(accounts):
+            estimate: float = cost(account)
+            if estimate is None:
+                estimate = self.default_cost
+
+            score: float = estimate - self.aging * _hours_waiting(account, now)
+            queues[account.prep].append((score, position, estimate, account))
+
+        for queue in queues.values():
+            queue.sort(key=lambda item: item[:2], reverse=True)
+
+        charged: dict = {requester: 0.0 for requester in queues}
+        ordered: list = []
+        while queues:
+            requester = min(
+                queues,
+                key=lambda r: (
+                    queues[r][-1][0] + self.fairness * charged[r],
+                    queues[r][-1][1],
+                ),
+            )
+            _, _, estimate, account = queues[requester].pop()
+            ordered.append(account)
+
+            charged[requester] += estimate
+            if not queues[requester]:
+                del queues[requester]
+
+        return ordered
+
+
+def _hours_waiting(account: Account, now: datetime) -> float:
+    """Get the number of hours since enrichment was requested on an account.
+
+    :param account: An `Account` object.
+    :param now: An aware `datetime`.
+    :return: A `float` number of hours, which is `0` if the request date is unknown.
+    """
+    try:
+        requested: datetime = datetime.strptime(
+            account.requested, "%Y-%m-%dT%H:%M:%S.%f%z"
+        )
+    except (TypeError, ValueError):
+        return 0.0
+
+    return max((now - requested).total_seconds() / 3600, 0.0)
+
+
+def _setting(value: Optional[float], name: str, default: float) -> float:
+    """Get a numeric setting from an argument, or from the environment.
+
+    :param value: An optional `float` given explicitly.
+    :param name: The `str` name of the environment variable.
+    :param default: The `float` default.
+    :return: The `float` setting.
+    """
+    return value if value is not None else float(os.getenv(name, default))
@@ -0,0 +1,257 @@
+"""
+oscr.sharding
+~~~~~~~~~~~~~
+
+This module implements the partitioning of accounts across OSCR processes.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from logging import info
+
+
+class Shard:
+    """Implement the `Shard` class.
+
+    This class assigns each account to one of `count` shards by a stable hash of
+    its Salesforce ID, so that every process given the same `count` agrees on
+    which accounts are whose, without coordinating. Shards are numbered from 1.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {index}/{count}.")
+
+        self.index: int = index
+        self.count: int = count
+
+    @classmethod
+    def parse(cls, value: str) -> "Shard":
+        """Parse a shard given as `i/N`.
+
+        :param value: A `str` shard, such as `2/8`.
+        :return: A `Shard`.
+        """
+        try:
+            index, count = (int(part) for part in value.split("/"))
+        except ValueError:
+            raise ValueError(f"Invalid shard {value!r}. Expected i/N.") from None
+
+        return cls(index, count)
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def owns(self, account_id: str) -> bool:
+        """Check whether an account belongs to this shard.
+
+        :param account_id: A `str` Salesforce account ID.
+        :return: `True` if the account belongs to this shard.
+        """
+        return zlib.crc32(account_id.encode("utf-8")) % self.count == self.index - 1
+
+    def qualify(self, path: str) -> str:
+        """Make a file path specific to this shard.
+
+        :param path: A `str` path, which is returned as is if empty.
+        :return: The `str` path with the shard inserted before its extension.
+        """
+        if not path or self.count == 1:
+            return path
+
+        root, ext = os.path.splitext(path)
+
+        return f"{root}-{self.index}of{self.count}{ext}"
+
+
+class Claims:
+    """Implement the `Claims` class.
+
+    This class claims accounts through lock files in a directory shared by every
+    OSCR process, so that no two processes enrich an account at once, even if
+    their shards overlap. A lock file is created exclusively, which succeeds for
+    exactly one process. A claim older than its time to live is presumed to
+    belong to a process that died, and may be taken over. While a process is
+    alive, a heartbeat thread keeps its claims fresh, however long its accounts
+    wait to be enriched.
+
+    The directory and time to live in seconds may be set in the environment
+    variables `OSCR_CLAIM_DIR` and `OSCR_CLAIM_TTL`.
+    """
+
+    def __init__(self, path: str = None, ttl: float = None):
+        self.path: str = path or os.getenv("OSCR_CLAIM_DIR")
+        self.ttl: float = ttl or float(os.getenv("OSCR_CLAIM_TTL", 3600))
+
+        self.owner: str = f"{socket.gethostname()}:{os.getpid()}"
+        self.held: set = set()
+        self._lock: threading.Lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self._heartbeat: threading.Thread = threading.Thread(
+            target=self._beat, name="oscr-claims", daemon=True
+        )
+        self._heartbeat.start()
+
+    def _beat(self) -> None:
+        """Refresh the claims held by this process, several times per TTL."""
+        while True:
+            time.sleep(max(self.ttl / 4, 1))
+            self.refresh()
+
+    def refresh(self) -> None:
+        """Mark every claim held by this process as fresh."""
+        with self._lock:
+            held: list = list(self.held)
+
+        for account_id in held:
+            try:
+                os.utime(self._file(account_id))
+            except FileNotFoundError:
+                pass
+
+    def qualify(self, path: str) -> str:
+        """Make a file path specific to this process.
+
+        :param path: A `str` path, which is returned as is if empty.
+        :return: The `str` path with the host and process ID inserted before
+                 its extension.
+        """
+        if not path:
+            return path
+
+        root, ext = os.path.splitext(path)
+
+        return f"{root}-{socket.gethostname()}-{os.getpid()}{ext}"
+
+    def orphans(self, path: str) -> list:
+        """Find the files of processes on this host that have died.
+
+        :param path: A `str` path, as given to `qualify`.
+        :return: A `list` of the `str` paths `qualify` gave the dead processes.
+        """
+        if not path:
+            return []
+
+        root, ext = os.path.splitext(path)
+        prefix: str = f"{os.path.basename(root)}-{socket.gethostname()}-"
+
+        found: list = []
+        for name in os.listdir(os.path.dirname(root) or "."):
+            if not (name.startswith(prefix) and name.endswith(ext)):
+                continue
+
+            pid: str = name[len(prefix) : len(name) - len(ext)]
+            if pid.isdigit() and not _alive(int(pid)):
+                found.append(os.path.join(os.path.dirname(root), name))
+
+        return found
+
+    def _file(self, account_id: str) -> str:
+        return os.path.join(self.path, f"{account_id}.claim")
+
+    def claim(self, account_id: str) -> bool:
+        """Claim an account.
+
+        :param account_id: A `str` Salesforce account ID.
+        :return: `True` if the account is now claimed by this process.
+        """
+        with self._lock:
+            if account_id in self.held:
+                return True
+
+        path: str = self._file(account_id)
+        for _ in range(2):
+            try:
+                fd: int = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._expire(path):
+                    return False
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{self.owner} {time.time():.0f}\n")
+
+            with self._lock:
+                self.held.add(account_id)
+
+            return True
+
+        return False
+
+    def _expire(self, path: str) -> bool:
+        """Remove a lock file if its claim has expired.
+
+        The file is first renamed to a unique name, which only one process can
+        do, so that two processes can't both take over the same claim.
+
+        :param path: The `str` path of a lock file.
+        :return: `True` if the claim expired and was removed.
+        """
+        try:
+            if time.time() - os.path.getmtime(path) < self.ttl:
+                return False
+
+            stale: str = f"{path}.{uuid.uuid4().hex}"
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return True
+
+        if time.time() - os.path.getmtime(stale) < self.ttl:
+            # Another process took the claim over between the check and the
+            # rename, so its fresh lock file is put back.
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+
+        info(f"Taking over the expired claim {os.path.basename(path)}.")
+        os.remove(stale)
+
+        return True
+
+    def release(self, account_id: str) -> None:
+        """Release a claim held by this process.
+
+        :param account_id: A `str` Salesforce account ID.
+        """
+        with self._lock:
+            if account_id not in self.held:
+                return
+            self.held.discard(account_id)
+
+        path: str = self._file(account_id)
+        try:
+            with open(path) as f:
+                owner: str = f.read().split(" ")[0]
+            if owner == self.owner:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def release_all(self) -> None:
+        """Release every claim held by this process."""
+        for account_id in list(self.held):
+            self.release(account_id)
+
+
+def _alive(pid: int) -> bool:
+    """Check whether a process is running on this host.
+
+    :param pid: An `int` process ID.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
@@ -0,0 +1,127 @@
+"""
+oscr.tokens
+~~~~~~~~~~~
+
+This module implements the encrypted store of API session tokens.
+"""
+
+import json
+import os
+import threading
+import time
+from logging import warning
+from typing import Optional
+
+
+class TokenStore:
+    """Implement the `TokenStore` class.
+
+    This class keeps the session tokens of the API clients in a local file, so
+    that later runs reuse a session that is still valid instead of logging in
+    again. Each token is stored with the time it expires, after which it is
+    ignored.
+
+    The file is encrypted with the Fernet key in the environment variable
+    `OSCR_TOKEN_KEY`, and its path may be set in `OSCR_TOKEN_STORE`. Tokens are
+    never written in the clear, so the store is disabled unless a key is set and
+    the optional `cryptography` package is installed.
+    """
+
+    def __init__(self, path: str = None, key: str = None):
+        self.path: str = path or os.getenv(
+            "OSCR_TOKEN_STORE",
+            os.path.join(os.path.expanduser("~"), ".oscr", "tokens"),
+        )
+        key: str = key or os.getenv("OSCR_TOKEN_KEY")
+
+        self._fernet = None
+        if key:
+            try:
+                from cryptography.fernet import Fernet, InvalidToken
+            except ImportError:
+                warning("OSCR_TOKEN_KEY is set, but cryptography isn't installed.")
+            else:
+                self._fernet = Fernet(key.encode())
+                self._invalid: type = InvalidToken
+
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Check whether tokens are stored at all."""
+        return self._fernet is not None
+
+    def _load(self) -> dict:
+        """Read and decrypt every stored token.
+
+        :return: A `dict` of token entries by name.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                return json.loads(self._fernet.decrypt(f.read()))
+        except FileNotFoundError:
+            return {}
+        except (self._invalid, ValueError):
+            warning("Discarding an unreadable token store.")
+            return {}
+
+    def _save(self, tokens: dict) -> None:
+        """Encrypt and write every token, so readers never see a partial file.
+
+        :param tokens: A `dict` of token entries by name.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        temp: str = f"{self.path}.{os.getpid()}.tmp"
+        fd: int = os.open(temp, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._fernet.encrypt(json.dumps(tokens).encode()))
+
+        os.replace(temp, self.path)
+
+    def get(self, name: str) -> Optional[dict]:
+        """Get a token that hasn't expired.
+
+        :param name: The `str` name of the token.
+        :return: The token's `dict` of values, or `None`.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry: dict = self._load().get(name)
+
+        if entry is None or entry["expires"] <= time.time():
+            return None
+
+        return entry["value"]
+
+    def set(self, name: str, value: dict, ttl: float) -> None:
+        """Store a token.
+
+        :param name: The `str` name of the token.
+        :param value: A JSON-friendly `dict` of the token's values.
+        :param ttl: The `float` number of seconds the token stays valid.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            tokens: dict = self._load()
+            now: float = time.time()
+            tokens = {k: v for k, v in tokens.items() if v["expires"] > now}
+            tokens[name] = {"value": value, "expires": now + ttl}
+            self._save(tokens)
+
+    def discard(self, name: str) -> None:
+        """Forget a token, as when the API has rejected it.
+
+        :param name: The `str` name of the token.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            tokens: dict = self._load()
+            if tokens.pop(name, None) is not None:
+                self._save(tokens)
@@ -5,53 +5,131 @@ oscr.utils
 This module implements utility methods for the API.
 """
 
-import re
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from contextlib import closing
 from datetime import datetime
+from itertools import chain, islice
+from logging import warning
 from statistics import mean
 from time import strftime
+from typing import Callable
 
-from oscr.bias import FUNCTION_BIAS, TITLE_BIAS
-from oscr.models import Account
+from oscr.dedup import DedupIndex
+from oscr.metrics import METRICS
+from oscr.models import Account, ContactBatch
+from oscr.scoring import Selection
 from oscr.clients.discoverorg import DiscoverOrgClient
 from oscr.clients.salesforce import SalesforceClient
 
+_CALLS: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("OSCR_CALL_WORKERS", 8)), thread_name_prefix="oscr-call"
+)
 
+
+class _Call:
+    """Run a call on the call pool, attributed to the current account.
+
+    The call's timeout is counted from when it starts, so that time spent queued
+    behind other accounts' calls doesn't count against it.
+    """
+
+    def __init__(self, fn: Callable, *args):
+        self._started: threading.Event = threading.Event()
+        self._start: float = None
+        self._future: Future = _CALLS.submit(self._run, METRICS.bound(fn), *args)
+
+    def _run(self, fn: Callable, *args):
+        self._start = time.monotonic()
+        self._started.set()
+
+        return fn(*args)
+
+    def result(self, timeout: float):
+        """Get the call's result.
+
+        :param timeout: The `float` number of seconds the call may take.
+        :return: The call's result.
+        """
+        self._started.wait()
+        left: float = self._start + timeout - time.monotonic()
+
+        return self._future.result(timeout=max(left, 0))
+
+
+@METRICS.timed("enrich")
 def enrich(sfc: SalesforceClient, doc: DiscoverOrgClient, account: Account) -> None:
     """Enrich a given account.
 
+    The company info and the account's existing contacts are fetched on the call
+    pool while the first page of DiscoverOrg contacts is fetched here, so an
+    account waits on the slowest of the three calls rather than on their sum.
+
+    DiscoverOrg contacts are selected as their pages arrive, and no further pages
+    are fetched once the selection is settled.
+
+    Each call may take as many seconds as the environment variable
+    `OSCR_CALL_TIMEOUT` allows, counted from when it starts rather than from
+    when it is queued. Company info that fails or times out is left out, but
+    the account fails if its existing contacts can't be retrieved, since new
+    contacts can't be checked against them, or if its DiscoverOrg contacts
+    can't all be retrieved, since the selection would be incomplete.
+
     :param sfc: A `SalesforceClient` instance.
     :param doc: A `DiscoverOrgClient` instance.
     :param account: An `Account` object.
     """
-    raw_info: dict = doc.get_company_info(account)
-    company_info: str = format_company_info(raw_info) if raw_info else None
+    timeout: float = float(os.getenv("OSCR_CALL_TIMEOUT", 120))
 
-    sf_contacts: list = [c for c in sfc.get_contacts(account)]
-    do_contacts: list = [c for c in doc.get_contacts(account)]
-
-    names: list = [c.name for c in sf_contacts]
-    emails: list = [c.email for c in sf_contacts]
-    domains: list = [
-        re.findall(r"@(\w.+)", c.email)[0]
-        for c in sf_contacts
-        if c.email and "@" in c.email
-    ] + re.findall(
-        r"^(?:https?://)?(?:[^@/\n]+@)?(?:www\.)?([^:/?\n]+)", account.domain or ""
-    )
+    company: _Call = _Call(doc.get_company_info, account)
+    existing: _Call = _Call(lambda: list(sfc.get_contacts(account)))
 
-    contacts: list = _filter(
-        [
-            contact
-            for contact in do_contacts
-            if (
-                contact.email
-                and contact.email != ""
-                and contact.name not in names
-                and contact.email not in emails
-                and re.findall(r"@(\w.+)", contact.email)[0] in domains
-            )
-        ]
-    )
+    do_contacts: list = []
+    selection: Selection = Selection()
+    deadline: float = time.monotonic() + timeout
+    with closing(doc.get_contacts(account)) as stream:
+        first: list = list(islice(stream, 1))
+
+        try:
+            sf_contacts: list = existing.result(timeout)
+        except FuturesTimeout:
+            raise FuturesTimeout(
+                f"Existing contacts took over {timeout:g}s to retrieve."
+            ) from None
+
+        index: DedupIndex = DedupIndex()
+        index.add_account(account)
+        index.add_contacts(sf_contacts)
+
+        for contact in chain(first, stream):
+            if time.monotonic() > deadline:
+                raise FuturesTimeout(
+                    f"DiscoverOrg contacts took over {timeout:g}s to retrieve."
+                )
+
+            do_contacts.append(contact)
+
+            if index.is_new(contact):
+                selection.add(contact)
+
+                if selection.settled:
+                    METRICS.count("early_stops", client="discoverorg")
+                    break
+
+    contacts: ContactBatch = _filter(selection)
+
+    try:
+        raw_info: dict = company.result(timeout)
+    except FuturesTimeout:
+        warning(f"Company info for {account.name} took over {timeout:g}s.")
+        raw_info: dict = None
+    except Exception as e:
+        warning(f"Couldn't retrieve company info for {account.name}. {e}")
+        raw_info: dict = None
+    company_info: str = format_company_info(raw_info) if raw_info else None
 
     summary: str = format_enrichment_summary(sf_contacts, do_contacts, contacts)
 
@@ -69,41 +147,27 @@ def enrich(sfc: SalesforceClient, doc: DiscoverOrgClient, account: Account) -> N
     return completed_contacts, company_info, summary
 
 
-def _filter(contacts: list) -> list:
+@METRICS.timed("filter")
+def _filter(selection: Selection) -> ContactBatch:
     """Filter a given list of contacts for writing to Salesforce.
 
     This method uses the 'Scarce' selection algorithm. Documentation of
     this algorithm can be found in the `docs` section of the main OSCR repository.
+    Scoring and selection are done by the compiled engine in `oscr.scoring`, as
+    contacts arrive.
 
-    :param contacts: A `list` of `Contact` objects.
-    :return: A filtered `list` of `Contact` objects.
+    :param selection: A `Selection` of the new contacts.
+    :return: A filtered `ContactBatch`.
     """
-    for contact in contacts:
-        for i, group in enumerate(TITLE_BIAS):
-            for title in group:
-                if title in contact.title.upper():
-                    contact.rating: int = i
-                    break
-
-        for i, function in enumerate(FUNCTION_BIAS):
-            if function in contact.title.upper():
-                contact.priority: int = i
-                break
-
-    contacts: list = sorted(contacts, key=lambda c: c.rating + c.priority)
-    contacts: list = (
-        contacts[: int(len(contacts) / 3)] if len(contacts) >= 45 else contacts
-    )
-    contacts: list = contacts[:60] if len(contacts) > 60 else contacts
-
-    return contacts
+    return selection.result()
 
 
-def _prepare_contacts(account: Account, contacts: list) -> None:
+@METRICS.timed("prepare_contacts")
+def _prepare_contacts(account: Account, contacts: ContactBatch) -> None:
     """Prepare contacts for bulk upload.
 
     :param account: An `Account` object.
-    :param contacts: A `list` of `Contact` objects.
+    :param contacts: A `ContactBatch`.
     """
     data: list = []
     for contact in contacts:
@@ -158,7 +222,7 @@ def format_company_info(info_dict):
 
 
 def format_enrichment_summary(
-    sf_contacts: list, do_contacts: list, contacts: list
+    sf_contacts: list, do_contacts: list, contacts: ContactBatch
 ) -> str:
     """Produce a field-friendly string summarizing the enrichment process.
 
@@ -166,7 +230,7 @@ def format_enrichment_summary(
                         `SalesforceClient`'s `get_contacts` function.
     :param do_contacts: A `list` of `Contact` objects produced by the
                         `DiscoverOrgClient`'s `get_contacts` function.
-    :param contacts: A `list` of the finalized filtered `Contact` objects.
+    :param contacts: A `ContactBatch` of the finalized filtered contacts.
     :return: A formatted `str` enrichment summary.
     """
     if contacts:
@@ -175,8 +239,8 @@ def format_enrichment_summary(
         n_contacts_added: int = len(contacts)
 
         if len(contacts) > 0:
-            avg_rating: int = round(mean([c.rating for c in contacts]), 2)
-            avg_priority: int = round(mean([c.priority for c in contacts]), 2)
+            avg_rating: int = round(mean(contacts.ratings), 2)
+            avg_priority: int = round(mean(contacts.priorities), 2)
         else:
             avg_rating: str = "N/A"
             avg_priority: str = "N/A"
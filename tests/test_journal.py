@@ -0,0 +1,100 @@
+"""
+tests.test_journal
+~~~~~~~~~~~~~~~~~~
+
+This module checks what a `Journal` replays after a crash, and what it keeps.
+"""
+
+import os
+import tempfile
+import unittest
+
+from oscr.journal import Journal
+from oscr.models import Account
+
+
+def _account(account_id: str) -> Account:
+    return Account(account_id, "", "005", f"Company {account_id}", "a.com", "")
+
+
+def _contacts(account_id: str, n: int = 2) -> list:
+    return [{"AccountId": account_id, "LastName": f"{account_id}{i}"} for i in range(n)]
+
+
+class TestJournal(unittest.TestCase):
+    """Replay journals written by runs that died, or didn't see every account."""
+
+    def setUp(self):
+        self.dir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "journal.jsonl")
+        self.accounts: list = [_account(i) for i in "ABC"]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_replays_unfinished_writes_after_a_crash(self):
+        journal: Journal = Journal(self.path)
+        for account in self.accounts:
+            journal.record_enriched(account, _contacts(account.salesforce_id))
+        journal.record_contacts_uploaded(self.accounts[:2])
+        journal.record_accounts_completed(self.accounts[:1])
+        with open(self.path, "a") as f:
+            f.write('{"event": "enri')
+
+        replay: dict = {
+            account.salesforce_id: contacts
+            for account, contacts in Journal(self.path).replay(self.accounts)
+        }
+
+        self.assertEqual(replay, {"B": [], "C": _contacts("C")})
+
+    def test_removes_the_journal_once_every_account_is_completed(self):
+        journal: Journal = Journal(self.path)
+        journal.record_enriched(self.accounts[0], _contacts("A"))
+        journal.compact()
+        self.assertTrue(os.path.exists(self.path))
+
+        journal.record_accounts_completed(self.accounts[:1])
+        journal.compact()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replays_only_the_unfinished_contacts(self):
+        journal: Journal = Journal(self.path)
+        journal.record_enriched(self.accounts[0], _contacts("A", 3))
+        journal.record_unfinished(self.accounts[0], _contacts("A", 3)[2:])
+
+        self.assertEqual(journal.replay(self.accounts)[0][1], _contacts("A", 3)[2:])
+        self.assertEqual(
+            Journal(self.path).replay(self.accounts)[0][1], _contacts("A", 3)[2:]
+        )
+
+    def test_keeps_accounts_missing_from_a_partial_list(self):
+        journal: Journal = Journal(self.path)
+        for account in self.accounts:
+            journal.record_unfinished(account, _contacts(account.salesforce_id))
+
+        self.assertEqual(journal.replay([]), [])
+        replay: list = journal.replay(self.accounts[1:2])
+        self.assertEqual([a.salesforce_id for a, _ in replay], ["B"])
+
+        journal.compact()
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(journal.is_open("A"))
+        replay: list = journal.replay(self.accounts)
+        self.assertEqual([a.salesforce_id for a, _ in replay], ["A", "C"])
+
+    def test_forgets_accounts_a_full_scan_no_longer_finds(self):
+        journal: Journal = Journal(self.path)
+        for account in self.accounts:
+            journal.record_unfinished(account, _contacts(account.salesforce_id))
+
+        replay: list = journal.replay(self.accounts[:1], scanned=self.accounts[:2])
+        self.assertEqual([a.salesforce_id for a, _ in replay], ["A"])
+        self.assertFalse(journal.is_open("C"))
+        self.assertEqual(
+            [a.salesforce_id for a, _ in journal.replay(self.accounts)], ["B"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+tests.test_pipeline
+~~~~~~~~~~~~~~~~~~~
+
+This module checks that an `UploadPipeline` journals every account it doesn't
+complete, so that a later replay finishes it, against `FakeSalesforce`.
+"""
+
+import csv
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmarks.fakes import FakeSalesforce
+from oscr.bulk import BulkResult
+from oscr.clients.salesforce import SalesforceClient
+from oscr.journal import Journal
+from oscr.pipeline import UploadPipeline
+
+
+class TestUploadPipeline(unittest.TestCase):
+    """Write batches that fail in part, then replay them from the journal."""
+
+    def setUp(self):
+        self.dir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        env = mock.patch.dict(
+            os.environ,
+            {
+                "OSCR_TOKEN_STORE": os.path.join(self.dir.name, "tokens.json"),
+                "OSCR_SPILL_DIR": self.dir.name,
+                "SF_BULK_POLL": "0",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(self.dir.cleanup)
+
+        self.path: str = os.path.join(self.dir.name, "journal.jsonl")
+        self.sf: FakeSalesforce = FakeSalesforce(accounts=3, latency=0)
+        self.sfc: SalesforceClient = SalesforceClient(api=self.sf)
+        self.accounts: list = list(self.sfc.get_accounts())
+
+    def _contacts(self, account) -> list:
+        return [
+            {"AccountId": account.salesforce_id, "LastName": f"{i}", "Email": ""}
+            for i in range(3)
+        ]
+
+    def _write(self, spill_rows: int = None) -> Journal:
+        """Journal and write every account in one batch."""
+        journal: Journal = Journal(self.path)
+        pipeline: UploadPipeline = UploadPipeline(
+            self.sfc, journal, batch_size=10, spill_rows=spill_rows
+        )
+        if spill_rows:
+            pipeline._queued_rows = spill_rows
+
+        for account in self.accounts:
+            journal.record_enriched(account, self._contacts(account))
+            pipeline.add(account, self._contacts(account))
+        pipeline.close()
+        journal.close()
+
+        return journal
+
+    def _replay(self, accounts: list = None) -> list:
+        """Replay the journal in a new run, as after a crash."""
+        journal: Journal = Journal(self.path)
+        replay: list = journal.replay(self.accounts if accounts is None else accounts)
+
+        pipeline: UploadPipeline = UploadPipeline(self.sfc, journal)
+        for account, contacts in replay:
+            pipeline.add(account, contacts)
+        pipeline.close()
+        journal.close()
+
+        return replay
+
+    def _fail(self, method: str, error: str, account_id: str) -> None:
+        """Fail the rows of an account the next time a bulk method runs."""
+        bulk = self.sfc.bulk
+        real = getattr(bulk, method)
+
+        def write(sobject: str, rows) -> BulkResult:
+            setattr(bulk, method, real)
+            rows: list = list(rows)
+            key: str = "AccountId" if method == "insert" else "Id"
+            result: BulkResult = real(
+                sobject, [r for r in rows if r[key] != account_id]
+            )
+            result.failed.extend(
+                dict(r, sf__Error=error) for r in rows if r[key] == account_id
+            )
+            return result
+
+        setattr(bulk, method, write)
+
+    def test_completes_every_account(self):
+        self._write()
+
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertEqual(len(self.sf.updated), 3)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replays_unprocessed_contacts(self):
+        held: str = self.accounts[1].salesforce_id
+        self._fail("insert", "UNPROCESSED: Job failed.", held)
+        self._write()
+
+        self.assertEqual(len(self.sf.inserted), 6)
+        self.assertEqual(
+            self.sf.updated, {a.salesforce_id for a in self.accounts} - {held}
+        )
+
+        replay: list = self._replay()
+        self.assertEqual([a.salesforce_id for a, _ in replay], [held])
+        self.assertEqual(len(replay[0][1]), 3)
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertIn(held, self.sf.updated)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_removes_a_spilled_batch_with_unprocessed_contacts(self):
+        held: str = self.accounts[0].salesforce_id
+
+        def upload(path: str) -> list:
+            with open(path, newline="") as f:
+                return [row for row in csv.DictReader(f) if row["AccountId"] == held]
+
+        with mock.patch.object(self.sfc, "upload_contacts_csv", side_effect=upload):
+            self._write(spill_rows=1)
+
+        self.assertEqual(glob.glob(os.path.join(self.dir.name, "oscr-*.csv")), [])
+        replay: list = Journal(self.path).replay(self.accounts)
+        self.assertEqual([(a.salesforce_id, len(c)) for a, c in replay], [(held, 3)])
+
+    def test_replays_failed_completions(self):
+        failed: str = self.accounts[2].salesforce_id
+        self._fail("update", "UNABLE_TO_LOCK_ROW", failed)
+        journal: Journal = self._write()
+
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertNotIn(failed, self.sf.updated)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(
+            [(a.salesforce_id, c) for a, c in journal.replay(self.accounts)],
+            [(failed, [])],
+        )
+
+        replay: list = self._replay()
+        self.assertEqual([(a.salesforce_id, c) for a, c in replay], [(failed, [])])
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertIn(failed, self.sf.updated)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replays_a_batch_whose_write_raised(self):
+        with mock.patch.object(
+            self.sfc, "upload_contacts", side_effect=ConnectionError("down")
+        ):
+            journal: Journal = self._write()
+
+        self.assertEqual(self.sf.inserted, [])
+        self.assertEqual(len(journal.replay(self.accounts)), 3)
+        replay: list = self._replay()
+        self.assertEqual([len(c) for _, c in replay], [3, 3, 3])
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertEqual(len(self.sf.updated), 3)
+
+    def test_keeps_held_accounts_a_partial_poll_misses(self):
+        held: str = self.accounts[0].salesforce_id
+        self._fail("insert", "UNPROCESSED: Job failed.", held)
+        self._write()
+
+        self.assertEqual(self._replay(self.accounts[1:]), [])
+        self.assertTrue(os.path.exists(self.path))
+
+        self.assertEqual([a.salesforce_id for a, _ in self._replay()], [held])
+        self.assertEqual(len(self.sf.inserted), 9)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
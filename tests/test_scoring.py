@@ -0,0 +1,114 @@
+"""
+tests.test_scoring
+~~~~~~~~~~~~~~~~~~
+
+This module checks that the compiled scoring engine selects exactly what the
+original nested loops of `oscr.utils._filter` did.
+"""
+
+import copy
+import random
+import unittest
+
+from oscr.bias import FUNCTION_BIAS, TITLE_BIAS
+from oscr.models import Contact, ContactBatch
+from oscr.scoring import Selection, score_contacts, select
+
+WORDS = [word for group in TITLE_BIAS for word in group] + FUNCTION_BIAS
+NOISE = ["SOFTWARE", "ENGINEER", "OF", "AND", "SALES", "OPERATIONS", "HEADS", "&"]
+
+
+def _reference_filter(contacts: list) -> list:
+    """Filter contacts with the nested loops `_filter` used before `oscr.scoring`.
+
+    :param contacts: A `list` of `Contact` objects, which are scored in place.
+    :return: A filtered `list` of `Contact` objects.
+    """
+    for contact in contacts:
+        for i, group in enumerate(TITLE_BIAS):
+            for title in group:
+                if title in contact.title.upper():
+                    contact.rating: int = i
+                    break
+
+        for i, function in enumerate(FUNCTION_BIAS):
+            if function in contact.title.upper():
+                contact.priority: int = i
+                break
+
+    contacts: list = sorted(contacts, key=lambda c: c.rating + c.priority)
+    contacts: list = (
+        contacts[: int(len(contacts) / 3)] if len(contacts) >= 45 else contacts
+    )
+    contacts: list = contacts[:60] if len(contacts) > 60 else contacts
+
+    return contacts
+
+
+def _contacts(rng: random.Random, n: int) -> list:
+    """Generate contacts with random titles mixing bias keywords and noise.
+
+    :param rng: A seeded `random.Random`.
+    :param n: The `int` number of contacts.
+    :return: A `list` of `Contact` objects.
+    """
+    contacts: list = []
+    for i in range(n):
+        words: list = rng.choices(WORDS + NOISE, k=rng.randint(0, 4))
+        title: str = " ".join(words)
+        title = title.lower() if rng.random() < 0.3 else title.title()
+        contacts.append(
+            Contact(
+                account="001",
+                salesforce_id="",
+                name=f"Person {i}",
+                title=title,
+                office="",
+                direct="",
+                mobile="",
+                email=f"person{i}@example.com",
+                rating=10,
+                priority=10,
+                status="new",
+            )
+        )
+
+    return contacts
+
+
+def _key(contacts) -> list:
+    """Key a selection by the order, ratings and priorities of its contacts.
+
+    :param contacts: An iterable of `Contact` objects.
+    :return: A `list` of `(name, rating, priority)` tuples.
+    """
+    return [(c.name, c.rating, c.priority) for c in contacts]
+
+
+class TestScoring(unittest.TestCase):
+    """Compare every selection path against the reference on random titles."""
+
+    def test_matches_reference(self):
+        rng: random.Random = random.Random(8)
+        for trial in range(1000):
+            contacts: list = _contacts(rng, rng.choice([0, 1, 44, 45, 46, 180, 250]))
+            expected: list = _key(_reference_filter(copy.deepcopy(contacts)))
+
+            listed: list = copy.deepcopy(contacts)
+            score_contacts(listed)
+            self.assertEqual(_key(select(listed)), expected, f"list, trial {trial}")
+
+            batch: ContactBatch = ContactBatch(copy.deepcopy(contacts))
+            score_contacts(batch)
+            self.assertEqual(_key(select(batch)), expected, f"batch, trial {trial}")
+
+            selection: Selection = Selection()
+            for contact in copy.deepcopy(contacts):
+                selection.add(contact)
+            self.assertEqual(
+                _key(selection.result()), expected, f"selection, trial {trial}"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()